@@ -1,6 +1,8 @@
-from typing import Self
+import io
+import math
+from typing import Callable, Mapping, Self, TextIO, cast
 
-from symbols import Operator, Variable, operators
+from symbols import FLOAT, OPERATOR, Operator, Variable, kind, operators
 from tokens import Token, shunting_yard, string_to_tokens
 from tree import Node
 
@@ -8,6 +10,10 @@ from tree import Node
 class AstNode(Node[Token]):
     """Abstract syntax tree for mathematical expressions."""
 
+    # Caches of free_variables and sort_key, cleared by invalidate.
+    _free_variables: frozenset[Variable] | None = None
+    _sort_key: tuple | None = None
+
     @classmethod
     def astify_rpn(cls, tokens: list[Token]):
         """Takes a sequence of tokens in reverse polish notation and returns
@@ -16,9 +22,10 @@ class AstNode(Node[Token]):
         """
         stack: list[AstNode] = []
         for token in tokens:
-            if isinstance(token, float | Variable):
+            if kind(token) != OPERATOR:
                 stack.append(cls.leafify(token))
-            elif isinstance(token, Operator):
+            else:
+                token = cast(Operator, token)
                 children = [stack.pop() for _ in range(token.arity)]
                 children.reverse()
                 new_node = cls(token, children)
@@ -61,30 +68,297 @@ class AstNode(Node[Token]):
         objects in the tree, but retains the existing operator instances.
         """
         cls = self.__class__
-        match self.value:
-            case float():
-                return cls.leafify(self.value)
-            case Variable():
-                return cls.leafify(self.value.__class__(self.value.string))
-            case Operator():
-                return cls(self.value, [child.copy() for child in self.children])
-            case _:
-                raise TypeError
+        value_kind = kind(self.value)
+        if value_kind == FLOAT:
+            return cls.leafify(self.value)
+        elif value_kind == OPERATOR:
+            return cls(self.value, [child.copy() for child in self.children])
+        else:
+            value = cast(Variable, self.value)
+            return cls.leafify(value.__class__(value.string))
+
+    def write_infix(self, stream: TextIO) -> None:
+        """Writes the expression to stream in infix notation, token by token,
+        without building the whole string. Uses an explicit stack, so it is
+        linear in the size of the tree and works for trees of any depth.
+
+        Parentheses are only written where astify needs them to rebuild an
+        equal tree. The parser reads every binary operator as left
+        associative, so an operand is parenthesised if its precedence is lower
+        than its parent's, or equal to it for all operands but the first.
+        Flattened sums and products are written as chains, which re-parse to
+        the unflattened tree.
+        """
+        stack: list[AstNode | str] = [self]
+        separator = ""
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                stream.write(separator + item)
+                separator = " "
+                continue
+            match item.value:
+                case Operator() if item.value.arity == 1:
+                    stack.extend([")", item.children[0], "(", item.value.string])
+                case Operator():
+                    for i in reversed(range(item.num_children())):
+                        child = item.children[i]
+                        if (
+                            isinstance(child.value, Operator)
+                            and child.value.arity != 1
+                            and (
+                                child.value.precedence < item.value.precedence
+                                or child.value.precedence == item.value.precedence
+                                and i > 0
+                            )
+                        ):
+                            stack.extend([")", child, "("])
+                        else:
+                            stack.append(child)
+                        if i > 0:
+                            stack.append(item.value.string)
+                case float():
+                    # repr writes large floats as 1e+16, which the tokeniser
+                    # would split at the +.
+                    stack.append(repr(float(item.value)).replace("e+", "e"))
+                case _:
+                    stack.append(repr(item.value))
+
+    def infix(self) -> str:
+        """Returns the expression in infix notation, see write_infix."""
+        stream = io.StringIO()
+        self.write_infix(stream)
+        return stream.getvalue()
+
+    def free_variables(self) -> frozenset[Variable]:
+        """Returns the variables in the tree. The result is cached on every node
+        of the tree, so subtrees which do not contain a variable can be
+        skipped in constant time.
+        """
+        if self._free_variables is None:
+            if isinstance(self.value, Variable):
+                self._free_variables = frozenset((self.value,))
+            else:
+                self._free_variables = frozenset().union(
+                    *(child.free_variables() for child in self.children)
+                )
+        return self._free_variables
+
+    def sort_key(self) -> tuple:
+        """Returns the key of the tree in a total structural order: floats,
+        then variables, then operator trees by precedence, opcode, arity and
+        then their children's keys. Structurally equal trees have equal keys.
+        The key is cached on every node of the tree and built from the cached
+        keys of the children, so it is only computed once per node.
+        """
+        if self._sort_key is None:
+            value = self.value
+            value_kind = kind(value)
+            if value_kind == FLOAT:
+                # NaN compares false with everything, so it gets a key of its
+                # own after every number, to keep the order total.
+                self._sort_key = (
+                    (value_kind, value) if value == value else (value_kind, math.inf, 0)
+                )
+            elif value_kind == OPERATOR:
+                operator = cast(Operator, value)
+                opcode = -1 if operator.opcode is None else operator.opcode
+                self._sort_key = (
+                    value_kind,
+                    operator.precedence,
+                    opcode,
+                    operator.string,
+                    len(self.children),
+                    tuple(child.sort_key() for child in self.children),
+                )
+            else:
+                self._sort_key = (value_kind, cast(Variable, value).string)
+        return self._sort_key
+
+    def invalidate(self) -> None:
+        """Clears the cached data of this node. Must be called on a node and
+        all its ancestors after the node is rewritten in place, which rewrite
+        does for the transformations.
+        """
+        self._free_variables = None
+        self._sort_key = None
+
+    def rewrite(self, rewrite_root: Callable[["AstNode"], bool]) -> bool:
+        """Applies rewrite_root, which rewrites a node in place and returns
+        whether it did, to every subtree bottom up in post-order. Returns
+        whether anything was rewritten, invalidating the rewritten nodes and
+        their ancestors.
+        """
+        changed = False
+        for child in self.children:
+            changed = child.rewrite(rewrite_root) or changed
+        changed = rewrite_root(self) or changed
+        if changed:
+            self.invalidate()
+        return changed
+
+    def with_children(self, children: list["AstNode"]) -> "AstNode":
+        """Returns self if children are the children of self, and otherwise a
+        new node with the value of self and the given children.
+        """
+        if len(children) == len(self.children) and all(
+            new is old for new, old in zip(children, self.children)
+        ):
+            return self
+        return AstNode(self.value, children)
+
+    def rewritten_root(self, rewrite_root: Callable[["AstNode"], bool]) -> "AstNode":
+        """Persistent counterpart of rewrite_root: applies it to a new node with
+        the value and a copy of the child list of self, and returns the new
+        node if it was rewritten and self otherwise. Rewrites only change the
+        root and its child list, so self is left unchanged.
+        """
+        scratch = AstNode(self.value, list(self.children))
+        return scratch if rewrite_root(scratch) else self
+
+    def rewritten(self, rewrite_root: Callable[["AstNode"], bool]) -> "AstNode":
+        """Persistent counterpart of rewrite: returns the tree rewritten bottom
+        up in post-order, or self if nothing was rewritten. Only the rewritten
+        nodes and their ancestors are copied, every other subtree is shared
+        with self, which is left unchanged.
+        """
+        node = self.with_children(
+            [child.rewritten(rewrite_root) for child in self.children]
+        )
+        if node is self:
+            return self.rewritten_root(rewrite_root)
+        # The node is new, so it can be rewritten in place.
+        rewrite_root(node)
+        return node
 
     def variables(self) -> set[Variable]:
-        variables: set[Variable] = set()
-        for node in self:
-            if isinstance(node.value, Variable):
-                variables.add(node.value)
-        return variables
+        return set(self.free_variables())
 
     def substitute_variables(self, substitutions: dict[Variable, "AstNode"]) -> None:
-        for node in self:
-            if isinstance(node.value, Variable) and (
-                substitution := substitutions.get(node.value)
-            ):
-                node.value = substitution.value
-                node.children = substitution.children
+        """Substitutes variables in place, skipping subtrees which contain none
+        of the variables to substitute. The children of a substitution are
+        shared by every occurrence, see compose for substituting into a new
+        tree.
+        """
+        if not self.free_variables().isdisjoint(substitutions):
+            if isinstance(self.value, Variable):
+                substitution = substitutions[self.value]
+                self.value = substitution.value
+                self.children = list(substitution.children)
+            else:
+                for child in self.children:
+                    child.substitute_variables(substitutions)
+            self.invalidate()
+
+    def compose(
+        self, substitutions: Mapping[Variable, "AstNode"], share: bool = False
+    ) -> "AstNode":
+        """Returns a new tree with the variables replaced simultaneously by the
+        given trees, e.g. composing f(x, y) with {x: y, y: x} swaps them. The
+        cached free variables index where the variables occur, so only the
+        nodes above an occurrence are rebuilt and self is left unchanged.
+
+        If share, every other subtree of self and the substituted trees are
+        shared with the result by reference, so composing is proportional to
+        the number of rebuilt nodes, but the result must be copied before being
+        rewritten in place. Otherwise they are copied, once per occurrence.
+        """
+        if self.free_variables().isdisjoint(substitutions):
+            return self if share else self.copy()
+        if isinstance(self.value, Variable):
+            substitution = substitutions[self.value]
+            return substitution if share else substitution.copy()
+        return AstNode(
+            self.value,
+            [child.compose(substitutions, share) for child in self.children],
+        )
+
+
+class LazyDerivative(AstNode):
+    """A D node which is expanded by a single differentiation rule only when
+    its value or children are first accessed, e.g. by traversal, evaluation or
+    printing. The D nodes introduced by the rule are lazy again, so branches of
+    the sum and product rules which are never looked at are never expanded.
+    The expansion is cached on the node by replacing its value and children.
+    """
+
+    def __init__(self, value: Token, children: list[AstNode]):
+        # Not Node.__init__, which would assign value and children through
+        # the setters below and so mark the node as expanded.
+        self._value = value
+        self._children = children
+        self._expanded = False
+
+    @classmethod
+    def of(cls, variable: Variable, expr: AstNode) -> "LazyDerivative":
+        """Returns the lazy derivative of expr w.r.t. variable. expr is copied,
+        since the expansions share its subtrees, which may later be rewritten
+        in place, and its subtractions and divisions are rewritten as in
+        derivatives.derivative_tree.
+        """
+        from derivatives import derivative_tree
+
+        tree = derivative_tree(expr, variable)
+        return cls(tree.value, tree.children)
+
+    @property
+    def value(self) -> Token:
+        if not self._expanded:
+            self.expand()
+        return self._value
+
+    @value.setter
+    def value(self, value: Token):
+        self._expanded = True
+        self._value = value
+
+    @property
+    def children(self) -> list[AstNode]:
+        if not self._expanded:
+            self.expand()
+        return self._children
+
+    @children.setter
+    def children(self, children: list[AstNode]):
+        self._expanded = True
+        self._children = children
+
+    def expand(self) -> None:
+        """Applies the first matching differentiation rule at the root. If none
+        matches the node stays an ordinary D node.
+        """
+        from match import Differentiation, PatternMatching, differentiation_rules
+
+        self._expanded = True
+        if Differentiation.is_constant(self):
+            self._value = 0.0
+            self._children = []
+            return
+        for rule in differentiation_rules:
+            bindings = {}
+            if PatternMatching.match(self, rule.pattern, bindings):
+                result = self.instantiate(rule.replacement, bindings)
+                self._value = result.value
+                self._children = result.children
+                return
+
+    @classmethod
+    def instantiate(
+        cls, template: AstNode, bindings: dict[Variable, AstNode]
+    ) -> AstNode:
+        """Builds the replacement of a rule, making its D nodes lazy."""
+        if template.is_leaf():
+            if (binding := bindings.get(template.value)) is not None:
+                return binding
+            return AstNode.leafify(template.value)
+        children = [cls.instantiate(child, bindings) for child in template.children]
+        if template.value == operators["D"]:
+            return cls(template.value, children)
+        return AstNode(template.value, children)
+
+    def copy(self) -> AstNode:
+        """Copies the fully expanded derivative into an ordinary tree."""
+        return AstNode(self.value, self.children).copy()
 
 
 if __name__ == "__main__":
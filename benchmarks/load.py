@@ -0,0 +1,123 @@
+"""Load generator for server.py. Opens concurrent connections which each send
+requests one at a time, and reports throughput and latency percentiles. Starts
+a local server unless --port is given.
+
+    python benchmarks/load.py [--port PORT] [--connections 32] [--requests 2000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+exprs = [
+    "x * x * sin(x) + x ^ 3 + 2 * x",
+    "exp(sin(x) * cos(x))",
+    "ln(sq(x) + 1) / x",
+    "x * y - y ^ 2 * exp(y)",
+    "sin(cos(exp(x * y)))",
+]
+
+
+def random_request(i: int, distinct: int) -> dict:
+    """A mix of operations on a pool of distinct expressions, so that some
+    requests are coalesced or answered from the cache.
+    """
+    n = random.randrange(distinct)
+    expr = f"{exprs[n % len(exprs)]} + {n} * x"
+    match random.choice(["differentiate", "differentiate", "normalise", "evaluate"]):
+        case "differentiate":
+            return {"id": i, "op": "differentiate", "expr": expr, "variable": "x"}
+        case "normalise":
+            return {"id": i, "op": "normalise", "expr": expr}
+        case _:
+            values = {"x": random.random(), "y": 0.5}
+            return {"id": i, "op": "evaluate", "expr": expr, "values": values}
+
+
+async def client(
+    port: int, requests: list[dict], latencies: list[float], errors: list[dict]
+) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for request in requests:
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if "error" in response:
+            errors.append(response)
+    writer.close()
+
+
+async def run(port: int, connections: int, total: int, distinct: int) -> None:
+    requests = [random_request(i, distinct) for i in range(total)]
+    latencies: list[float] = []
+    errors: list[dict] = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            client(port, requests[i::connections], latencies, errors)
+            for i in range(connections)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{total} requests over {connections} connections in {elapsed:.2f} s")
+    print(f"    throughput  {total / elapsed:10.1f} requests/s")
+    for p in [50, 90, 99]:
+        print(f"    p{p:<10} {percentiles[p - 1] * 1000:10.2f} ms")
+    print(f"    errors      {len(errors):10d}")
+
+
+def wait_for_server(port: int, timeout: float = 10.0) -> None:
+    async def connect() -> None:
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.close()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            asyncio.run(connect())
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, help="port of a running server")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=200)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    server = None
+    port = args.port
+    if port is None:
+        port = 8765
+        command = [sys.executable, os.path.join(root, "server.py"), "--port", str(port)]
+        if args.workers:
+            command += ["--workers", str(args.workers)]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        wait_for_server(port)
+    try:
+        asyncio.run(run(port, args.connections, args.requests, args.distinct))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measures the import time of the modules, and the time to first use of the
+rule sets with and without the precompiled rule cache, which is enabled by
+setting SYMDIFF_RULE_CACHE. Each measurement runs in a fresh interpreter.
+
+    python benchmarks/startup.py [repeats]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+cases = {
+    "import astree": "import astree",
+    "import match": "import match",
+    "import pipeline": "import pipeline",
+    "first use of differentiation_pipeline": (
+        "import pipeline; pipeline.differentiation_pipeline"
+    ),
+}
+
+
+timer = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def run(code: str, cache_dir: str) -> float:
+    """Returns the time taken by code in a new interpreter."""
+    env = dict(os.environ, PYTHONPATH=root, SYMDIFF_RULE_CACHE=cache_dir)
+    result = subprocess.run(
+        [sys.executable, "-c", timer.format(code=code)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(result.stdout)
+
+
+def main(repeats: int) -> None:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for cache in ["", cache_dir]:
+            print(f"rule cache: {'on' if cache else 'off'}")
+            for name, code in cases.items():
+                run(code, cache)  # warm the rule and bytecode caches
+                times = [run(code, cache) for _ in range(repeats)]
+                print(f"    {name:40} {statistics.median(times) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,111 @@
+"""Compares traversal strategies on the same differentiation and normalisation
+rules. Reports the time per expression and the number of times a group was
+tried at a node, and checks that every strategy reaches an equivalent result.
+
+    python benchmarks/strategies.py [repeats]
+"""
+
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astree import AstNode  # noqa: E402
+from numeric import evaluate  # noqa: E402
+from pipeline import (  # noqa: E402
+    Innermost,
+    Outermost,
+    Repeat,
+    Rule,
+    Step,
+    TopDownOnce,
+    TransformationGroup,
+    TransformationPipeline,
+    differentiation_group,
+    normalisation_group,
+)
+from symbols import Variable  # noqa: E402
+
+exprs = [
+    "x D (x * x * sin(x) + x ^ 3 + 2 * x)",
+    "x D exp(sin(x) * cos(x))",
+    "x D (ln(sq(x) + 1) * exp(x * x))",
+    "x D (sin(cos(exp(x * x))) * ( x + 1 ) ^ 5)",
+    "x D (x * x * x * x * x * x * sin(x) * cos(x) * exp(x))",
+]
+
+
+class Counted:
+    """Counts the calls of apply_root of a rule."""
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.calls = 0
+
+    def apply_root(self, expr: AstNode) -> bool:
+        self.calls += 1
+        return self.rule.apply_root(expr)
+
+
+def strategies(
+    differentiation: Counted, normalisation: Counted
+) -> dict[str, Step]:
+    return {
+        "repeated bottom up passes": TransformationPipeline(
+            [
+                TransformationGroup([differentiation]),  # pyright: ignore
+                TransformationGroup([normalisation]),  # pyright: ignore
+            ]
+        ),
+        "repeated top down passes": TransformationPipeline(
+            [
+                Repeat(TopDownOnce(differentiation)),  # pyright: ignore
+                Repeat(TopDownOnce(normalisation)),  # pyright: ignore
+            ]
+        ),
+        "innermost": TransformationPipeline(
+            [Innermost(differentiation), Innermost(normalisation)]  # pyright: ignore
+        ),
+        "outermost": TransformationPipeline(
+            [Outermost(differentiation), Outermost(normalisation)]  # pyright: ignore
+        ),
+    }
+
+
+def main(repeats: int) -> None:
+    names = [
+        "repeated bottom up passes",
+        "repeated top down passes",
+        "innermost",
+        "outermost",
+    ]
+    values = {Variable("x"): 0.3}
+    results: dict[str, list[float]] = {}
+    for name in names:
+        differentiation = Counted(differentiation_group)
+        normalisation = Counted(normalisation_group)
+        strategy = strategies(differentiation, normalisation)[name]
+        times = []
+        for _ in range(repeats):
+            trees = [AstNode.astify(expr) for expr in exprs]
+            start = time.perf_counter()
+            for tree in trees:
+                strategy.apply_all(tree)
+            times.append((time.perf_counter() - start) / len(exprs))
+            results[name] = [evaluate(tree, values) for tree in trees]
+        calls = (differentiation.calls + normalisation.calls) // repeats
+        print(
+            f"    {name:<30} {statistics.median(times) * 1000:8.3f} ms"
+            f" {calls:10d} rule calls"
+        )
+    expected = results[names[0]]
+    for name, result in results.items():
+        if not all(map(math.isclose, result, expected)):
+            print(f"{name} disagrees")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
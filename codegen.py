@@ -0,0 +1,214 @@
+import keyword
+import math
+from typing import Callable, Sequence
+
+from astree import AstNode
+from symbols import Operator, Variable
+
+# Templates for each operator, formatted with the already generated operand
+# strings. Sums and products with more than two operands are folded left.
+# Extend these to generate code for new operators.
+python_templates: dict[str, str] = {
+    "+": "{0} + {1}",
+    "-": "{0} - {1}",
+    "*": "{0} * {1}",
+    "/": "{0} / {1}",
+    "^": "{0} ** {1}",
+    "sq": "{0} * {0}",
+    "exp": "math.exp({0})",
+    "sin": "math.sin({0})",
+    "cos": "math.cos({0})",
+    "ln": "math.log({0})",
+}
+
+c_templates: dict[str, str] = {
+    "+": "{0} + {1}",
+    "-": "{0} - {1}",
+    "*": "{0} * {1}",
+    "/": "{0} / {1}",
+    "^": "pow({0}, {1})",
+    "sq": "{0} * {0}",
+    "exp": "exp({0})",
+    "sin": "sin({0})",
+    "cos": "cos({0})",
+    "ln": "log({0})",
+}
+
+
+def python_float(value: float) -> str:
+    if math.isnan(value):
+        return "math.nan"
+    elif math.isinf(value):
+        return "math.inf" if value > 0 else "(-math.inf)"
+    return repr(value) if value >= 0 else f"({value!r})"
+
+
+def c_float(value: float) -> str:
+    if math.isnan(value):
+        return "NAN"
+    elif math.isinf(value):
+        return "INFINITY" if value > 0 else "(-INFINITY)"
+    return repr(value) if value >= 0 else f"({value!r})"
+
+
+# Variable names which would clash with the generated code: keywords, the
+# names the templates and signatures use, and the prefix of the temporaries.
+temporary_prefix = "_t"
+python_reserved = frozenset(keyword.kwlist) | {"math"}
+c_reserved = frozenset(
+    """auto break case char const continue default do double else enum extern
+    float for goto if inline int long register restrict return short signed
+    sizeof static struct switch typedef union unsigned void volatile while
+    _Bool _Complex _Imaginary out pow exp sin cos log""".split()
+)
+
+
+def straight_line(
+    exprs: Sequence[AstNode], float_literal: Callable[[float], str]
+) -> tuple[list[tuple[str, Operator, list[str]]], list[str]]:
+    """Linearises the expressions into assignments (temporary, operator,
+    operands) and the names of their results. Structurally equal subtrees,
+    within and across the expressions, are assigned only once.
+    """
+    assignments: list[tuple[str, Operator, list[str]]] = []
+    subterms: dict[tuple, str] = {}
+    names: dict[int, str] = {}
+    outputs: list[str] = []
+    for expr in exprs:
+        for node in expr:
+            if id(node) in names:
+                continue
+            match node.value:
+                case float():
+                    name = float_literal(node.value)
+                case Variable():
+                    name = node.value.string
+                case Operator():
+                    operands = [names[id(child)] for child in node.children]
+                    key = (node.value.string, *operands)
+                    if (name := subterms.get(key)) is None:
+                        name = f"{temporary_prefix}{len(assignments)}"
+                        subterms[key] = name
+                        assignments.append((name, node.value, operands))
+                case _:
+                    raise TypeError
+            names[id(node)] = name
+        outputs.append(names[id(expr)])
+    return assignments, outputs
+
+
+def render(
+    templates: dict[str, str], operator: Operator, operands: list[str]
+) -> str:
+    if (template := templates.get(operator.string)) is None:
+        raise ValueError(f"No code template for {operator}")
+    code = template.format(*operands[:2])
+    for operand in operands[2:]:
+        code = template.format(code, operand)
+    return code
+
+
+def default_args(exprs: Sequence[AstNode]) -> list[Variable]:
+    variables: set[Variable] = set()
+    for expr in exprs:
+        variables |= expr.variables()
+    return sorted(variables, key=lambda variable: variable.string)
+
+
+def check_names(names: Sequence[str], reserved: frozenset[str]) -> None:
+    for name in names:
+        if not name.isidentifier():
+            raise ValueError(f"{name} is not a valid identifier")
+        if name in reserved or name.startswith(temporary_prefix):
+            raise ValueError(f"{name} clashes with a name in the generated code")
+
+
+def check_signature(
+    name: str,
+    args: Sequence[Variable],
+    variables: Sequence[Variable],
+    reserved: frozenset[str],
+) -> None:
+    """Checks that the function name and arguments can be used in the
+    generated code, and that the arguments include every variable.
+    """
+    check_names([name, *(arg.string for arg in args)], reserved)
+    if missing := set(variables) - set(args):
+        names = ", ".join(sorted(variable.string for variable in missing))
+        raise ValueError(f"No argument for the variables {names}")
+
+
+def python_source(
+    exprs: AstNode | Sequence[AstNode],
+    name: str = "f",
+    args: Sequence[Variable] | None = None,
+) -> str:
+    """Returns the source of an importable Python module defining a function
+    which evaluates the expression, or a tuple of the expressions if a list is
+    given. The arguments default to the variables in alphabetical order.
+    """
+    single = isinstance(exprs, AstNode)
+    exprs = [exprs] if isinstance(exprs, AstNode) else exprs
+    variables = default_args(exprs)
+    args = variables if args is None else args
+    check_signature(name, args, variables, python_reserved)
+    assignments, outputs = straight_line(exprs, python_float)
+
+    lines = ["import math", "", "", f"def {name}({', '.join(map(str, args))}):"]
+    for temporary, operator, operands in assignments:
+        code = render(python_templates, operator, operands)
+        lines.append(f"    {temporary} = {code}")
+    if single:
+        lines.append(f"    return {outputs[0]}")
+    else:
+        lines.append(f"    return ({''.join(output + ', ' for output in outputs)})")
+    return "\n".join(lines) + "\n"
+
+
+def compile_python(
+    exprs: AstNode | Sequence[AstNode],
+    name: str = "f",
+    args: Sequence[Variable] | None = None,
+) -> Callable[..., float]:
+    """Generates and executes the Python source, returning the function."""
+    namespace: dict[str, object] = {}
+    exec(compile(python_source(exprs, name, args), f"<{name}>", "exec"), namespace)
+    return namespace[name]  # pyright: ignore
+
+
+def c_source(
+    exprs: AstNode | Sequence[AstNode],
+    name: str = "f",
+    args: Sequence[Variable] | None = None,
+) -> str:
+    """Returns C99 source text defining a function which evaluates the
+    expression. If a list of expressions is given the function writes them to
+    an extra output array argument instead.
+    """
+    single = isinstance(exprs, AstNode)
+    exprs = [exprs] if isinstance(exprs, AstNode) else exprs
+    variables = default_args(exprs)
+    args = variables if args is None else args
+    check_signature(name, args, variables, c_reserved)
+    assignments, outputs = straight_line(exprs, c_float)
+
+    params = [f"double {arg}" for arg in args]
+    if single:
+        signature = f"double {name}({', '.join(params) or 'void'})"
+    else:
+        signature = f"void {name}({', '.join(params + ['double *out'])})"
+    lines = ["#include <math.h>", "", signature, "{"]
+    for temporary, operator, operands in assignments:
+        code = render(c_templates, operator, operands)
+        lines.append(f"    const double {temporary} = {code};")
+    if single:
+        lines.append(f"    return {outputs[0]};")
+    else:
+        for i, output in enumerate(outputs):
+            lines.append(f"    out[{i}] = {output};")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    pass
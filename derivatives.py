@@ -0,0 +1,229 @@
+from typing import Callable, Iterable, Sequence
+
+from astree import AstNode
+from codegen import compile_python
+from pipeline import (
+    Innermost,
+    TransformationGroup,
+    TransformationPipeline,
+    apply_batch,
+)
+from symbols import Variable, operators
+
+type MultiIndex = tuple[tuple[Variable, int], ...]
+
+
+def multi_index(variables: Iterable[Variable]) -> MultiIndex:
+    """Converts a sequence of variables to differentiate by, e.g. (x, y, x),
+    into its canonical multi-index ((x, 2), (y, 1)). Mixed partials commute,
+    so the order of the variables does not matter.
+    """
+    counts: dict[Variable, int] = {}
+    for variable in variables:
+        counts[variable] = counts.get(variable, 0) + 1
+    return tuple(sorted(counts.items(), key=lambda item: item[0].string))
+
+
+def lower_index(index: MultiIndex, variable: Variable) -> MultiIndex:
+    """Returns the multi-index with the order of variable reduced by one."""
+    return tuple(
+        (var, order - 1 if var == variable else order)
+        for var, order in index
+        if not (var == variable and order == 1)
+    )
+
+
+def derivative_tree(expr: AstNode, variable: Variable, share: bool = False) -> AstNode:
+    """Returns the unexpanded tree variable D expr. The subtractions and
+    divisions in expr are first rewritten with normalisation_patterns, which
+    the differentiation rules need. expr is left untouched, and is copied
+    unless share, when the tree shares the subtrees of expr without - or /.
+    """
+    from match import normalisation_patterns
+
+    expansion = Innermost(TransformationGroup(normalisation_patterns))
+    operand = expansion.transform(expr if share else expr.copy())
+    return AstNode(operators["D"], [AstNode.leafify(variable), operand])
+
+
+def differentiate(
+    expr: AstNode,
+    variable: Variable,
+    pipeline: TransformationPipeline | None = None,
+) -> AstNode:
+    """Returns the derivative of expr w.r.t. variable, leaving expr untouched.
+    The pipeline defaults to differentiation_pipeline. It is applied with
+    transform, so expr is not copied and the derivative shares the subtrees
+    of expr which the pipeline leaves unchanged.
+    """
+    if pipeline is None:
+        from pipeline import differentiation_pipeline as pipeline
+    return pipeline.transform(derivative_tree(expr, variable, share=True))
+
+
+class PartialDerivatives:
+    """Memoised higher-order and mixed partial derivatives of a single
+    expression. Every partial derivative is computed by differentiating an
+    already normalised partial derivative of one order lower, so each entry of
+    the table is built by exactly one run of the differentiation pipeline.
+
+    The returned trees are shared with the table and must be copied before
+    being modified in place.
+    """
+
+    def __init__(
+        self,
+        expr: AstNode,
+        pipeline: TransformationPipeline | None = None,
+    ):
+        self.expr = expr
+        self.pipeline = pipeline
+        self.table: dict[MultiIndex, AstNode] = {(): expr}
+
+    def partial(self, *variables: Variable) -> AstNode:
+        """Returns the partial derivative of the expression w.r.t. each of the
+        given variables in turn, e.g. partial(x, x, y) for d^3/dx^2dy.
+        """
+        return self.lookup(multi_index(variables))
+
+    def lookup(self, index: MultiIndex) -> AstNode:
+        """Returns the partial derivative for a canonical multi-index."""
+        if (derivative := self.table.get(index)) is not None:
+            return derivative
+        # Differentiate w.r.t. the last variable of the multi-index, so that
+        # tables filled in order of increasing total order always hit.
+        variable = index[-1][0]
+        derivative = differentiate(
+            self.lookup(lower_index(index, variable)), variable, self.pipeline
+        )
+        self.table[index] = derivative
+        return derivative
+
+    def up_to(self, variable: Variable, order: int) -> list[AstNode]:
+        """Returns the derivatives of orders 0 to order w.r.t. variable."""
+        return [self.lookup(multi_index([variable] * n)) for n in range(order + 1)]
+
+    def all_partials(
+        self, variables: list[Variable], order: int
+    ) -> dict[MultiIndex, AstNode]:
+        """Returns every partial derivative in the given variables up to and
+        including the given total order, keyed by multi-index.
+        """
+        partials: dict[MultiIndex, AstNode] = {(): self.expr}
+        level: set[MultiIndex] = {()}
+        for _ in range(order):
+            next_level: set[MultiIndex] = set()
+            for index in level:
+                expanded = [var for var, count in index for _ in range(count)]
+                for variable in variables:
+                    next_level.add(multi_index(expanded + [variable]))
+            for index in next_level:
+                partials[index] = self.lookup(index)
+            level = next_level
+        return partials
+
+    def gradient(self, variables: list[Variable]) -> list[AstNode]:
+        return [self.partial(variable) for variable in variables]
+
+    def hessian(self, variables: list[Variable]) -> list[list[AstNode]]:
+        """Returns the Hessian matrix. Only the upper triangle is computed, the
+        lower triangle shares the same trees.
+        """
+        return [
+            [self.partial(row, column) for column in variables]
+            for row in variables
+        ]
+
+
+class SparseJacobian:
+    """The structurally nonzero entries of a Jacobian matrix, in coordinate
+    format: entry k is the derivative of expression rows[k] w.r.t. variable
+    columns[k]. Entries are ordered by row, then column.
+    """
+
+    def __init__(
+        self,
+        shape: tuple[int, int],
+        variables: Sequence[Variable],
+        rows: list[int],
+        columns: list[int],
+        entries: list[AstNode],
+    ):
+        self.shape = shape
+        self.variables = variables
+        self.rows = rows
+        self.columns = columns
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def dense(self) -> list[list[AstNode]]:
+        """Returns the full matrix, with new 0 leaves for the missing entries."""
+        num_rows, num_columns = self.shape
+        matrix = [
+            [AstNode.leafify(0.0) for _ in range(num_columns)]
+            for _ in range(num_rows)
+        ]
+        for row, column, entry in zip(self.rows, self.columns, self.entries):
+            matrix[row][column] = entry
+        return matrix
+
+    def compile(self, args: Sequence[Variable] | None = None) -> Callable[..., tuple]:
+        """Compiles all the entries into one Python function returning a tuple
+        of their values, in the order of the entries. Subexpressions shared
+        between entries are evaluated once. The arguments default to the
+        variables, followed by any other free variables of the entries in
+        alphabetical order.
+        """
+        if args is None:
+            others: set[Variable] = set()
+            for entry in self.entries:
+                others |= entry.free_variables()
+            others -= set(self.variables)
+            args = [*self.variables, *sorted(others, key=lambda var: var.string)]
+        return compile_python(self.entries, "jacobian", args)
+
+
+def jacobian(
+    exprs: Sequence[AstNode],
+    variables: Sequence[Variable],
+    pipeline: TransformationPipeline | None = None,
+    parallel: bool = False,
+    max_workers: int | None = None,
+) -> SparseJacobian:
+    """Returns the sparse Jacobian of the expressions w.r.t. the variables.
+    Only the derivatives w.r.t. the free variables of each expression are
+    computed, the others being structurally zero, and entries which simplify
+    to 0 are dropped. If parallel, the entries are differentiated with
+    apply_batch. The expressions are left untouched, and unless parallel the
+    entries share their unchanged subtrees.
+    """
+    if pipeline is None:
+        from pipeline import differentiation_pipeline as pipeline
+    rows: list[int] = []
+    columns: list[int] = []
+    trees: list[AstNode] = []
+    for row, expr in enumerate(exprs):
+        free_variables = expr.free_variables()
+        for column, variable in enumerate(variables):
+            if variable in free_variables:
+                rows.append(row)
+                columns.append(column)
+                trees.append(derivative_tree(expr, variable, share=not parallel))
+    if parallel:
+        trees = apply_batch(pipeline, trees, max_workers)
+    else:
+        trees = [pipeline.transform(tree) for tree in trees]
+    nonzero = [k for k, tree in enumerate(trees) if tree.value != 0.0]
+    return SparseJacobian(
+        (len(exprs), len(variables)),
+        variables,
+        [rows[k] for k in nonzero],
+        [columns[k] for k in nonzero],
+        [trees[k] for k in nonzero],
+    )
+
+
+if __name__ == "__main__":
+    pass
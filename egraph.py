@@ -0,0 +1,300 @@
+import math
+from typing import Callable, Generator, Sequence
+
+import match
+from astree import AstNode
+from match import PatternMatching, PatternVariable
+from symbols import BinaryOperator, Operator, UnaryOperator
+from tokens import Token
+
+type ClassId = int
+type ENode = tuple[Token, tuple[ClassId, ...]]
+type Bindings = dict[PatternVariable, ClassId]
+type CostFunction = Callable[[Token, list[float]], float]
+
+
+def node_count(value: Token, child_costs: list[float]) -> float:
+    return 1 + sum(child_costs)
+
+
+# Rough relative costs of evaluating each operator once. Unexpanded derivatives
+# cannot be evaluated at all.
+operator_costs: dict[str, float] = {
+    "+": 1,
+    "-": 1,
+    "*": 2,
+    "sq": 2,
+    "/": 4,
+    "^": 8,
+    "exp": 10,
+    "ln": 10,
+    "sin": 10,
+    "cos": 10,
+    "D": math.inf,
+}
+
+
+def evaluation_cost(value: Token, child_costs: list[float]) -> float:
+    """Cost of numerically evaluating the expression, leaves being free."""
+    if isinstance(value, Operator):
+        return operator_costs.get(value.string, 10) + sum(child_costs)
+    return sum(child_costs)
+
+
+class EGraph:
+    """E-graph for equality saturation. Equivalent expressions are merged into
+    equivalence classes (e-classes) of e-nodes, whose children are e-classes,
+    so rewrites never destroy a form which has already been found. The
+    cheapest representative can then be extracted independently of the order
+    in which the rules were applied.
+
+    E-classes containing a float are tracked as constants, and operators whose
+    children are all constants are folded as they are added.
+    """
+
+    def __init__(self):
+        self.parents: list[ClassId] = []
+        self.classes: dict[ClassId, set[ENode]] = {}
+        self.hashcons: dict[ENode, ClassId] = {}
+        self.constants: dict[ClassId, float] = {}
+
+    def size(self) -> int:
+        return len(self.hashcons)
+
+    def find(self, class_id: ClassId) -> ClassId:
+        while (parent := self.parents[class_id]) != class_id:
+            self.parents[class_id] = self.parents[parent]
+            class_id = parent
+        return class_id
+
+    def canonicalise(self, enode: ENode) -> ENode:
+        value, children = enode
+        return value, tuple(self.find(child) for child in children)
+
+    def add_node(self, enode: ENode) -> ClassId:
+        enode = self.canonicalise(enode)
+        if (class_id := self.hashcons.get(enode)) is not None:
+            return self.find(class_id)
+        class_id = len(self.parents)
+        self.parents.append(class_id)
+        self.classes[class_id] = {enode}
+        self.hashcons[enode] = class_id
+        if isinstance(enode[0], float):
+            self.constants[class_id] = enode[0]
+        elif (constant := self.fold(enode)) is not None:
+            self.union(class_id, self.add_node((constant, ())))
+        return self.find(class_id)
+
+    def add(self, expr: AstNode) -> ClassId:
+        """Adds the tree and returns its e-class. Flattened sums and products
+        are added as left nested binary operations.
+        """
+        ids: dict[int, ClassId] = {}
+        for node in expr:
+            children = [ids[id(child)] for child in node.children]
+            while len(children) > 2:
+                children[:2] = [self.add_node((node.value, tuple(children[:2])))]
+            ids[id(node)] = self.add_node((node.value, tuple(children)))
+        return ids[id(expr)]
+
+    def fold(self, enode: ENode) -> float | None:
+        """Returns the value of the e-node if all its children are constant."""
+        value, children = enode
+        if not isinstance(value, UnaryOperator | BinaryOperator):
+            return None
+        args: list[float] = []
+        for child in children:
+            if (constant := self.constants.get(self.find(child))) is None:
+                return None
+            args.append(constant)
+        try:
+            result = value.func(*args)
+        except (ArithmeticError, ValueError):
+            return None
+        return result if isinstance(result, float) else None
+
+    def union(self, a: ClassId, b: ClassId) -> bool:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return False
+        if len(self.classes[a]) < len(self.classes[b]):
+            a, b = b, a
+        self.parents[b] = a
+        self.classes[a] |= self.classes.pop(b)
+        if (constant := self.constants.pop(b, None)) is not None:
+            self.constants.setdefault(a, constant)
+        return True
+
+    def rebuild(self) -> None:
+        """Restores the invariants after unions: every e-node is canonical,
+        congruent e-nodes are in the same e-class and constants are folded.
+        """
+        while True:
+            self.hashcons = {}
+            pending: list[tuple[ClassId, ClassId | float]] = []
+            for class_id, enodes in self.classes.items():
+                canonical = {self.canonicalise(enode) for enode in enodes}
+                self.classes[class_id] = canonical
+                for enode in canonical:
+                    if (other := self.hashcons.get(enode)) is not None:
+                        if other != class_id:
+                            pending.append((class_id, other))
+                    else:
+                        self.hashcons[enode] = class_id
+                    if class_id not in self.constants and (
+                        (constant := self.fold(enode)) is not None
+                    ):
+                        pending.append((class_id, constant))
+            changed = False
+            for class_id, other in pending:
+                if isinstance(other, float):
+                    other = self.add_node((other, ()))
+                changed |= self.union(class_id, other)
+            if not changed:
+                return
+
+    def ematch(
+        self, pattern: AstNode, class_id: ClassId, bindings: Bindings
+    ) -> Generator[Bindings]:
+        """Yields every extension of bindings under which pattern matches an
+        expression in the e-class.
+        """
+        class_id = self.find(class_id)
+        value = pattern.value
+        if isinstance(value, PatternVariable):
+            if value.match_type is float and class_id not in self.constants:
+                return
+            if (bound := bindings.get(value)) is not None:
+                if self.find(bound) == class_id:
+                    yield bindings
+            else:
+                yield {**bindings, value: class_id}
+        elif pattern.is_leaf():
+            if (value, ()) in self.classes[class_id]:
+                yield bindings
+        else:
+            for enode_value, children in list(self.classes[class_id]):
+                if enode_value == value and len(children) == pattern.num_children():
+                    yield from self.ematch_children(
+                        pattern.children, children, bindings
+                    )
+
+    def ematch_children(
+        self,
+        patterns: list[AstNode],
+        children: Sequence[ClassId],
+        bindings: Bindings,
+    ) -> Generator[Bindings]:
+        if not patterns:
+            yield bindings
+            return
+        for extended in self.ematch(patterns[0], children[0], bindings):
+            yield from self.ematch_children(patterns[1:], children[1:], extended)
+
+    def instantiate(self, template: AstNode, bindings: Bindings) -> ClassId:
+        if isinstance(template.value, PatternVariable):
+            return bindings[template.value]
+        children = tuple(
+            self.instantiate(child, bindings) for child in template.children
+        )
+        return self.add_node((template.value, children))
+
+    def saturate(
+        self,
+        rules: Sequence[PatternMatching],
+        iter_limit: int = 10,
+        node_limit: int = 10_000,
+    ) -> bool:
+        """Applies the rules non-destructively until nothing changes or a limit
+        is reached. Returns whether the e-graph was saturated.
+        """
+        for _ in range(iter_limit):
+            matches = [
+                (rule, class_id, bindings)
+                for rule in rules
+                for class_id in list(self.classes)
+                for bindings in self.ematch(rule.pattern, class_id, {})
+            ]
+            changed = False
+            for rule, class_id, bindings in matches:
+                changed |= self.union(
+                    class_id, self.instantiate(rule.replacement, bindings)
+                )
+                if self.size() > node_limit:
+                    self.rebuild()
+                    return False
+            self.rebuild()
+            if not changed:
+                return True
+        return False
+
+    def extract(
+        self, class_id: ClassId, cost: CostFunction = node_count
+    ) -> AstNode:
+        """Returns the cheapest expression of the e-class under cost, which is
+        given the node value and the costs of the children. Ties between
+        equally cheap expressions are broken by AstNode.sort_key, so the result
+        does not depend on set iteration order or hash randomisation.
+        """
+        best: dict[ClassId, tuple[float, ENode]] = {}
+        changed = True
+        while changed:
+            changed = False
+            for eclass, enodes in self.classes.items():
+                for enode in enodes:
+                    value, children = enode
+                    if not all(child in best for child in children):
+                        continue
+                    enode_cost = cost(value, [best[child][0] for child in children])
+                    if eclass not in best or enode_cost < best[eclass][0]:
+                        best[eclass] = (enode_cost, enode)
+                        changed = True
+
+        built: dict[ClassId, AstNode] = {}
+        visiting: set[ClassId] = set()
+
+        def build(eclass: ClassId) -> AstNode:
+            eclass = self.find(eclass)
+            if (node := built.get(eclass)) is not None:
+                return node
+            visiting.add(eclass)
+            eclass_cost, (best_value, best_children) = best[eclass]
+            candidates = [
+                AstNode(value, [build(child) for child in children])
+                for value, children in self.classes[eclass]
+                if not any(self.find(child) in visiting for child in children)
+                and all(child in best for child in children)
+                and cost(value, [best[child][0] for child in children]) == eclass_cost
+            ]
+            visiting.remove(eclass)
+            if candidates:
+                node = min(candidates, key=AstNode.sort_key)
+            else:
+                node = AstNode(best_value, [build(child) for child in best_children])
+            built[eclass] = node
+            return node
+
+        # The built trees share the subtrees of common e-classes.
+        return build(class_id).copy()
+
+
+def simplify(
+    expr: AstNode,
+    rules: Sequence[PatternMatching] | None = None,
+    cost: CostFunction = node_count,
+    iter_limit: int = 10,
+    node_limit: int = 10_000,
+) -> AstNode:
+    """Returns the cheapest expression equivalent to expr found by equality
+    saturation, by default with the normalisation and algebraic rules.
+    """
+    if rules is None:
+        rules = match.normalisation_patterns + match.algebraic_rules
+    egraph = EGraph()
+    class_id = egraph.add(expr)
+    egraph.saturate(rules, iter_limit, node_limit)
+    return egraph.extract(class_id, cost)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,133 @@
+import math
+import random
+import warnings
+
+from astree import AstNode
+from numeric import evaluate, np
+from symbols import Variable
+
+
+class Fingerprinter:
+    """Probabilistic equivalence of expressions by evaluating them at the same
+    random points. Each variable gets its own points, drawn from a generator
+    seeded by the seed and the variable name, so fingerprints are comparable
+    between expressions, runs and processes.
+
+    Expressions which agree at every point are reported equivalent. Distinct
+    analytic expressions rarely agree at even one random point, and the
+    chance of a false positive falls with every extra point. Points where an
+    expression is undefined, e.g. outside the domain of ln, are NaN, and two
+    expressions must be undefined at the same points to be equivalent. The
+    points include negative ones, so e.g. ln(x) and ln(sq(x)) / 2 differ.
+
+    A fingerprint defined at fewer than min_defined points, e.g. of an
+    expression which cannot be evaluated at all, says too little about the
+    expression. Such expressions are only equivalent to structurally equal
+    ones, and have no key.
+    """
+
+    def __init__(
+        self,
+        num_points: int = 16,
+        seed: int = 0,
+        low: float = -2.0,
+        high: float = 2.0,
+        digits: int = 6,
+        min_defined: int = 4,
+    ):
+        self.num_points = num_points
+        self.seed = seed
+        self.low = low
+        self.high = high
+        self.digits = digits
+        self.min_defined = min_defined
+        self.variable_points: dict[Variable, list[float]] = {}
+
+    def points(self, variable: Variable) -> list[float]:
+        if (points := self.variable_points.get(variable)) is None:
+            generator = random.Random(f"{self.seed}:{variable.string}")
+            points = [
+                generator.uniform(self.low, self.high) for _ in range(self.num_points)
+            ]
+            self.variable_points[variable] = points
+        return points
+
+    def fingerprint(self, expr: AstNode) -> list[float]:
+        """Returns the values of expr at the points, NaN where it is undefined.
+        Evaluates all the points at once with NumPy if it is installed.
+        """
+        variables = expr.free_variables()
+        if np is not None:
+            values = {
+                variable: np.array(self.points(variable)) for variable in variables
+            }
+            with np.errstate(all="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                try:
+                    result = evaluate(expr, values)
+                except (ArithmeticError, ValueError):
+                    pass
+                else:
+                    result = np.broadcast_to(
+                        np.asarray(result, dtype=complex), (self.num_points,)
+                    )
+                    real = np.where(result.imag == 0, result.real, np.nan)
+                    return [float(value) for value in real]
+        return [
+            self.evaluate_at(expr, {v: self.points(v)[i] for v in variables})
+            for i in range(self.num_points)
+        ]
+
+    @staticmethod
+    def evaluate_at(expr: AstNode, values: dict[Variable, float]) -> float:
+        try:
+            result = evaluate(expr, values)
+        except (ArithmeticError, ValueError):
+            return math.nan
+        return result if isinstance(result, float) else math.nan
+
+    def decidable(self, fingerprint: list[float]) -> bool:
+        """Returns whether the fingerprint is defined at enough points."""
+        defined = sum(not math.isnan(value) for value in fingerprint)
+        return defined >= min(self.min_defined, self.num_points)
+
+    def equivalent(
+        self,
+        a: AstNode,
+        b: AstNode,
+        rel_tol: float = 1e-9,
+        abs_tol: float = 1e-12,
+    ) -> bool:
+        """Returns whether a and b agree at every point, within tolerance, or
+        if either fingerprint is undecidable, whether they are structurally
+        equal.
+        """
+        fingerprint_a, fingerprint_b = self.fingerprint(a), self.fingerprint(b)
+        if not (self.decidable(fingerprint_a) and self.decidable(fingerprint_b)):
+            return a.is_equal(b)
+        for x, y in zip(fingerprint_a, fingerprint_b):
+            if math.isnan(x) or math.isnan(y):
+                if not (math.isnan(x) and math.isnan(y)):
+                    return False
+            elif not math.isclose(x, y, rel_tol=rel_tol, abs_tol=abs_tol):
+                return False
+        return True
+
+    def key(self, expr: AstNode) -> tuple[float | None, ...] | None:
+        """Returns a hashable key for the equivalence class of expr: its
+        fingerprint rounded to digits significant digits, NaN being None.
+        Rounding errors may still give equivalent expressions different keys
+        when a value lies close to a rounding boundary. Returns None if the
+        fingerprint is undecidable.
+        """
+        fingerprint = self.fingerprint(expr)
+        if not self.decidable(fingerprint):
+            return None
+        return tuple(
+            None if math.isnan(value) else float(f"{value:.{self.digits}g}")
+            for value in fingerprint
+        )
+
+
+if __name__ == "__main__":
+    pass
@@ -1,11 +1,26 @@
-from typing import cast
+import os
+import sys
+import threading
+from typing import Generator, cast
 
 from astree import AstNode
 from rules import Transformation
-from symbols import Operator, Variable
+from symbols import (
+    OPERATOR,
+    PATTERN_VARIABLE,
+    Operator,
+    UnaryOperator,
+    Variable,
+    kind,
+    operator_table,
+    operators,
+    registration_hooks,
+)
 
 
 class PatternVariable(Variable):
+    kind = PATTERN_VARIABLE
+
     def __init__(self, string: str, match_type: None | type[float] = None):
         """If a match type is not given, it is inferred from the string."""
         super().__init__(string)
@@ -49,9 +64,16 @@ class PatternMatching(Transformation):
         self.replacement = replacement
         PatternVariable.patternify(self.pattern)
         PatternVariable.patternify(self.replacement)
+        # Fill the caches now, so that rules are never written to once built
+        # and can be shared between threads.
+        self.pattern.free_variables()
+        self.replacement.free_variables()
 
     def apply_root(self, expr: AstNode):
-        """Applies the transformation in place onto the root of expr if able."""
+        """Applies the transformation in place onto the root of expr if able.
+        The bindings are local and the replacement is copied before it is
+        substituted into, so the rule itself is only read.
+        """
         bindings: dict[PatternVariable, AstNode] = {}
         if PatternMatching.match(expr, self.pattern, bindings):
             replacement = self.replacement.copy()
@@ -66,82 +88,315 @@ class PatternMatching(Transformation):
     def match(
         expr: AstNode, pattern: AstNode, bindings: dict[PatternVariable, AstNode]
     ) -> bool:
-        match pattern.value:
-            case float():
-                return expr.value == pattern.value
-
-            case PatternVariable():
-                if pattern.value.match(expr):
-                    if existing_binding := bindings.get(pattern.value):
-                        return expr.is_equal(existing_binding)
-                    else:
-                        bindings[pattern.value] = expr
-                        return True
+        """Returns whether pattern matches expr at the root, adding the bindings
+        of the first match found to bindings.
+        """
+        for _ in PatternMatching.matches(expr, pattern, bindings):
+            return True
+        return False
+
+    @staticmethod
+    def matches(
+        expr: AstNode, pattern: AstNode, bindings: dict[PatternVariable, AstNode]
+    ) -> Generator[None]:
+        """Yields once for every way pattern matches expr at the root. While
+        suspended, bindings holds the bindings of that match; they are undone
+        before the next match is searched for.
+        """
+        pattern_kind = kind(pattern.value)
+        if pattern_kind == PATTERN_VARIABLE:
+            variable = cast(PatternVariable, pattern.value)
+            if variable.match(expr):
+                if (existing_binding := bindings.get(variable)) is not None:
+                    if expr.is_equal(existing_binding):
+                        yield
                 else:
-                    return False
+                    bindings[variable] = expr
+                    yield
+                    del bindings[variable]
+
+        elif pattern_kind != OPERATOR:  # float or Variable
+            if expr.value == pattern.value:
+                yield
+
+        else:
+            operator = cast(Operator, pattern.value)
+            if kind(expr.value) != OPERATOR or expr.value != operator:
+                return
+            elif operator.commutative and operator.associative == "full":
+                yield from PatternMatching.matches_ac(expr, pattern, bindings)
+            elif expr.num_children() == pattern.num_children():
+                yield from PatternMatching.matches_children(
+                    expr.children, pattern.children, bindings, 0
+                )
+
+    @staticmethod
+    def matches_children(
+        exprs: list[AstNode],
+        patterns: list[AstNode],
+        bindings: dict[PatternVariable, AstNode],
+        i: int,
+    ) -> Generator[None]:
+        """Matches the children positionally from the i-th onwards."""
+        if i == len(patterns):
+            yield
+            return
+        for _ in PatternMatching.matches(exprs[i], patterns[i], bindings):
+            yield from PatternMatching.matches_children(
+                exprs, patterns, bindings, i + 1
+            )
 
-            case Variable():
-                return expr.value == pattern.value
+    @staticmethod
+    def matches_ac(
+        expr: AstNode, pattern: AstNode, bindings: dict[PatternVariable, AstNode]
+    ) -> Generator[None]:
+        """Matches the children of an associative and commutative operator as
+        multisets, so the pattern also matches flattened n-ary sums and
+        products. Each pattern child is matched to a distinct child of expr. If
+        expr has more children than the pattern, the last pattern variable
+        which matches anything takes all of the leftover children, e.g. f * g
+        matches a * b * c with f = a and g = b * c.
+
+        Pattern children are tried in order against the children of expr in
+        order, so binary expressions match positionally first.
+        """
+        exprs, patterns = expr.children, pattern.children
+        rest = None
+        if len(exprs) > len(patterns):
+            for i, child in enumerate(patterns):
+                if isinstance(child.value, PatternVariable) and (
+                    child.value.match_type == "all"
+                ):
+                    rest = i
+            if rest is None:
+                return
+        elif len(exprs) < len(patterns):
+            return
+        fixed = [child for i, child in enumerate(patterns) if i != rest]
+        used = [False] * len(exprs)
 
-            case _:  # Operator():
-                if not isinstance(expr.value, Operator) or expr.value != pattern.value:
-                    return False
+        def assign(i: int) -> Generator[None]:
+            if i == len(fixed):
+                if rest is None:
+                    yield
                 else:
-                    for expr_child, pattern_child in zip(
-                        expr.children, pattern.children
-                    ):
-                        if not PatternMatching.match(
-                            expr_child, pattern_child, bindings
-                        ):
-                            return False
-                    return True
+                    leftovers = [child for child, u in zip(exprs, used) if not u]
+                    yield from PatternMatching.matches(
+                        AstNode(expr.value, leftovers), patterns[rest], bindings
+                    )
+                return
+            for j, child in enumerate(exprs):
+                if used[j] or not PatternMatching.heads_match(child, fixed[i]):
+                    continue
+                used[j] = True
+                for _ in PatternMatching.matches(child, fixed[i], bindings):
+                    yield from assign(i + 1)
+                used[j] = False
+
+        yield from assign(0)
+
+    @staticmethod
+    def heads_match(expr: AstNode, pattern: AstNode) -> bool:
+        """Cheap necessary condition for pattern to match expr at the root."""
+        if kind(pattern.value) == PATTERN_VARIABLE:
+            return cast(PatternVariable, pattern.value).match(expr)
+        return expr.value == pattern.value
 
 
 class Differentiation(PatternMatching):
-    pass
+    def apply_root(self, expr: AstNode) -> bool:
+        """Differentiates subtrees which do not contain the variable to 0 at
+        once, before trying the rule itself.
+        """
+        if Differentiation.is_constant(expr):
+            expr.value = 0.0
+            expr.children = []
+            return True
+        return super().apply_root(expr)
+
+    @staticmethod
+    def is_constant(expr: AstNode) -> bool:
+        """Returns whether expr is x D f with f not containing x."""
+        if expr.value != operators["D"]:
+            return False
+        variable, sub_expr = expr.children
+        return (
+            isinstance(variable.value, Variable)
+            and variable.value not in sub_expr.free_variables()
+        )
 
 
-normalisation_patterns: list[PatternMatching] = [
-    PatternMatching(
-        "- to +", AstNode.astify("f - g"), AstNode.astify("f + ( -1 * g )")
-    ),
-    PatternMatching("/ to *", AstNode.astify("f / g"), AstNode.astify("f * g ^ -1")),
+# Rule sets as (name, pattern, replacement) in infix notation. The rules are
+# only parsed when a rule set is first used, see __getattr__, so that importing
+# this module stays cheap.
+normalisation_specs: list[tuple[str, str, str]] = [
+    ("- to +", "f - g", "f + ( -1 * g )"),
+    ("/ to *", "f / g", "f * g ^ -1"),
 ]
 
-differentiation_rules = [
-    Differentiation("constant", AstNode.astify("x D s"), AstNode.astify("0")),
-    Differentiation("variable", AstNode.astify("x D x"), AstNode.astify("1")),
-    Differentiation(
-        "sum rule",
-        AstNode.astify("x D ( f + g )"),
-        AstNode.astify("( x D f ) + ( x D g )"),
-    ),
-    Differentiation(
-        "product rule",
-        AstNode.astify("x D ( f * g )"),
-        AstNode.astify("( ( x D f ) * g ) + ( f * ( x D g ) )"),
-    ),
-    Differentiation(
-        "power rule",
-        AstNode.astify("x D (f ^ s)"),
-        AstNode.astify("s * f ^ (s - 1) * x D f"),
-    ),
-    Differentiation(
-        "exponential rule",
-        AstNode.astify("x D exp(f)"),
-        AstNode.astify("exp(f) * (x D f)"),
-    ),
-    Differentiation(
-        "sine rule",
-        AstNode.astify("x D sin(f)"),
-        AstNode.astify("cos(f) * (x D f)"),
-    ),
-    Differentiation(
-        "cosine rule",
-        AstNode.astify("x D cos(f)"),
-        AstNode.astify("-1 * sin(f) * (x D f)"),
-    ),
+# Algebraic identities for equality saturation in egraph.py. Commutativity and
+# associativity make them loop if applied destructively by a TransformationGroup.
+algebraic_specs: list[tuple[str, str, str]] = [
+    ("+ commutativity", "f + g", "g + f"),
+    ("* commutativity", "f * g", "g * f"),
+    ("+ associativity", "f + ( g + h )", "( f + g ) + h"),
+    ("* associativity", "f * ( g * h )", "( f * g ) * h"),
+    ("+ identity", "f + 0", "f"),
+    ("* identity", "f * 1", "f"),
+    ("* zero", "f * 0", "0"),
+    ("^ identity", "f ^ 1", "f"),
+    ("^ zero", "f ^ 0", "1"),
+    ("- self", "f - f", "0"),
+    ("+ inverse", "f + ( -1 * f )", "0"),
+    ("+ doubling", "f + f", "2 * f"),
+    ("* squaring", "f * f", "sq(f)"),
+    ("factorisation", "( f * g ) + ( f * h )", "f * ( g + h )"),
+    ("ln exp", "ln(exp(f))", "f"),
 ]
 
+differentiation_specs: list[tuple[str, str, str]] = [
+    ("constant", "x D s", "0"),
+    ("variable", "x D x", "1"),
+    ("sum rule", "x D ( f + g )", "( x D f ) + ( x D g )"),
+    ("product rule", "x D ( f * g )", "( ( x D f ) * g ) + ( f * ( x D g ) )"),
+    ("power rule", "x D (f ^ s)", "s * f ^ (s - 1) * x D f"),
+]
+
+rule_sets: dict[str, tuple[type[PatternMatching], list[tuple[str, str, str]]]] = {
+    "normalisation_patterns": (PatternMatching, normalisation_specs),
+    "algebraic_rules": (PatternMatching, algebraic_specs),
+    "differentiation_rules": (Differentiation, differentiation_specs),
+}
+
+# Directory of the precompiled rule cache, None or "" to disable it, which is
+# the default. See load_rules before enabling it.
+rule_cache_dir: str | None = os.environ.get("SYMDIFF_RULE_CACHE")
+
+_rules_lock = threading.Lock()
+
+
+def chain_rule_spec(operator: Operator) -> tuple[str, str, str] | None:
+    """Returns the chain rule for a unary operator with a symbolic derivative."""
+    if isinstance(operator, UnaryOperator) and operator.symbolic_derivative:
+        return (
+            f"{operator} chain rule",
+            f"x D {operator}(f)",
+            f"( {operator.symbolic_derivative} ) * ( x D f )",
+        )
+    return None
+
+
+def all_specs() -> dict[str, list[tuple[str, str, str]]]:
+    specs = {name: list(rule_specs) for name, (_, rule_specs) in rule_sets.items()}
+    for operator in operator_table:
+        if spec := chain_rule_spec(operator):
+            specs["differentiation_rules"].append(spec)
+    return specs
+
+
+def build_rules(
+    specs: dict[str, list[tuple[str, str, str]]],
+) -> dict[str, list[PatternMatching]]:
+    return {
+        name: [
+            rule_sets[name][0](
+                rule_name, AstNode.astify(pattern), AstNode.astify(replacement)
+            )
+            for rule_name, pattern, replacement in rule_specs
+        ]
+        for name, rule_specs in specs.items()
+    }
+
+
+# Modules whose classes are pickled in the rule cache, or which build them.
+rule_cache_modules = ["match", "rules", "astree", "tree", "symbols", "tokens"]
+
+
+def rule_cache_key(specs: dict[str, list[tuple[str, str, str]]]) -> str:
+    """Hashes the rule specifications, the Python version and the source of
+    the modules which build the rules, so a cache written by other code is
+    never loaded.
+    """
+    import hashlib
+
+    digest = hashlib.sha256(repr((sys.version_info[:2], specs)).encode())
+    for name in rule_cache_modules:
+        with open(cast(str, sys.modules[name].__file__), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def load_rules() -> dict[str, list[PatternMatching]]:
+    """Builds all the rule sets, loading them from the precompiled cache if it
+    was written for the same rule specifications and code, else writing it.
+
+    The cache is loaded with pickle, which runs arbitrary code from the file,
+    so rule_cache_dir must only be writable by users trusted to run code in
+    this process. It is off by default: building the rules only takes a few
+    milliseconds, and building them lazily on first use already keeps them
+    out of import time.
+    """
+    import pickle
+
+    specs = all_specs()
+    if not rule_cache_dir:
+        return build_rules(specs)
+    try:
+        key = rule_cache_key(specs)
+    except OSError:
+        return build_rules(specs)
+    path = os.path.join(rule_cache_dir, f"rules.{key[:16]}.pickle")
+    try:
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    except (
+        OSError,
+        pickle.UnpicklingError,
+        EOFError,
+        AttributeError,
+        KeyError,
+        ImportError,
+        TypeError,
+    ):
+        pass
+    rules = build_rules(specs)
+    try:
+        os.makedirs(rule_cache_dir, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump(rules, file)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+    return rules
+
+
+def __getattr__(name: str) -> list[PatternMatching]:
+    """Builds the rule sets on first access."""
+    if name not in rule_sets:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _rules_lock:
+        if name not in globals():
+            globals().update(load_rules())
+    return globals()[name]
+
+
+def add_chain_rule(operator: Operator) -> None:
+    """Adds the chain rule of an operator registered after the differentiation
+    rules were built. Operators registered before are picked up by all_specs.
+    """
+    if spec := chain_rule_spec(operator):
+        rule_name, pattern, replacement = spec
+        with _rules_lock:
+            if "differentiation_rules" in globals():
+                globals()["differentiation_rules"].append(
+                    Differentiation(
+                        rule_name, AstNode.astify(pattern), AstNode.astify(replacement)
+                    )
+                )
+
+
+registration_hooks.append(add_chain_rule)
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,272 @@
+import copy
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from typing import Generator, cast
+
+from astree import AstNode
+from pipeline import (
+    Rule,
+    Step,
+    Strategy,
+    TransformationGroup,
+    TransformationPipeline,
+)
+from rules import Transformation
+from symbols import Operator
+from tree import Node
+
+
+class TreeStats:
+    """Memory statistics of a tree, which may share subtrees.
+
+    nodes counts every position in the tree, so a subtree shared twice
+    counts twice, objects counts the distinct node objects and subtrees the
+    structurally distinct subtrees. size is the deep size in bytes of the
+    distinct objects, leaving out the registered operators, which all trees
+    share. sharing is nodes / objects, 1 for a tree without sharing.
+    """
+
+    def __init__(self, nodes: int, objects: int, subtrees: int, size: int):
+        self.nodes = nodes
+        self.objects = objects
+        self.subtrees = subtrees
+        self.size = size
+        self.sharing = nodes / objects
+
+    def __repr__(self):
+        return (
+            f"TreeStats(nodes={self.nodes}, objects={self.objects}, "
+            f"subtrees={self.subtrees}, size={self.size}, "
+            f"sharing={self.sharing:.3g})"
+        )
+
+
+def tree_stats(expr: AstNode) -> TreeStats:
+    """Returns the statistics of expr in time linear in the number of
+    distinct node objects, however much they are shared.
+    """
+    counts: dict[int, int] = {}
+    subterms: dict[int, int] = {}
+    keys: dict[tuple, int] = {}
+    seen: set[int] = set()
+    size = 0
+
+    def deep_size(obj: object) -> int:
+        if id(obj) in seen or isinstance(obj, Operator):
+            return 0
+        seen.add(id(obj))
+        total = sys.getsizeof(obj)
+        if isinstance(obj, AstNode):
+            total += deep_size(obj.__dict__)
+        elif isinstance(obj, dict):
+            total += sum(deep_size(value) for value in obj.values())
+        elif isinstance(obj, list | frozenset):
+            # Child nodes are sized on their own.
+            total += sum(deep_size(x) for x in obj if not isinstance(x, Node))
+        elif hasattr(obj, "__dict__"):
+            total += deep_size(vars(obj))
+        return total
+
+    stack: list[tuple[AstNode, bool]] = [(expr, False)]
+    while stack:
+        node, visited = stack.pop()
+        if id(node) in counts:
+            continue
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+            continue
+        counts[id(node)] = 1 + sum(counts[id(child)] for child in node.children)
+        key = (node.value, tuple(subterms[id(child)] for child in node.children))
+        subterms[id(node)] = keys.setdefault(key, len(keys))
+        size += deep_size(node)
+    return TreeStats(counts[id(expr)], len(counts), len(keys), size)
+
+
+class AllocationCounts:
+    """Nodes created and discarded, and with tracemalloc the net bytes
+    allocated, over every call of a rule or step.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.created = 0
+        self.discarded = 0
+        self.allocated = 0
+
+    def __repr__(self):
+        return (
+            f"AllocationCounts(calls={self.calls}, created={self.created}, "
+            f"discarded={self.discarded}, allocated={self.allocated})"
+        )
+
+
+# Nodes created and discarded while counting is on.
+created = 0
+discarded = 0
+_counting = 0
+
+
+def counting_init(self: AstNode, value, children) -> None:
+    global created
+    created += 1
+    Node.__init__(self, value, children)
+
+
+def counting_del(self: AstNode) -> None:
+    global discarded
+    discarded += 1
+
+
+@contextmanager
+def counting() -> Generator[None]:
+    """Counts the AstNodes created and discarded in the block, by temporarily
+    replacing AstNode.__init__ and adding a finaliser. LazyDerivative nodes
+    are not counted. Not thread-safe: other threads are counted too.
+    """
+    global _counting
+    if _counting == 0:
+        AstNode.__init__ = counting_init  # pyright: ignore
+        AstNode.__del__ = counting_del  # pyright: ignore
+    _counting += 1
+    try:
+        yield
+    finally:
+        _counting -= 1
+        if _counting == 0:
+            del AstNode.__init__
+            del AstNode.__del__
+
+
+class Tracked:
+    """Wraps a rule or step, adding the allocations of each call to counts."""
+
+    def __init__(
+        self,
+        wrapped: Rule | Step,
+        counts: AllocationCounts,
+        tracker: "AllocationTracker",
+    ):
+        self.wrapped = wrapped
+        self.counts = counts
+        self.tracker = tracker
+
+    def apply_root(self, expr: AstNode) -> bool:
+        with self.tracker.measure(self.counts):
+            return cast(Rule, self.wrapped).apply_root(expr)
+
+    def apply_all(self, expr: AstNode) -> bool:
+        with self.tracker.measure(self.counts):
+            return self.wrapped.apply_all(expr)
+
+    def transform(self, expr: AstNode) -> AstNode:
+        with self.tracker.measure(self.counts):
+            return self.wrapped.transform(expr)
+
+
+class AllocationTracker:
+    """Records the nodes created and discarded by every rule and every step
+    of a pipeline, by running an instrumented copy of it. The counts of a
+    step include those of its rules and nested steps. With use_tracemalloc
+    the net bytes allocated are recorded too, at a large cost in speed.
+
+        tracker = AllocationTracker()
+        tracker.run(differentiation_pipeline, expr)
+        print(tracker.report())
+    """
+
+    def __init__(self, use_tracemalloc: bool = False):
+        self.use_tracemalloc = use_tracemalloc
+        self.rules: dict[str, AllocationCounts] = {}
+        self.steps: dict[str, AllocationCounts] = {}
+
+    @contextmanager
+    def measure(self, counts: AllocationCounts) -> Generator[None]:
+        created_before, discarded_before = created, discarded
+        if self.use_tracemalloc:
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            counts.calls += 1
+            counts.created += created - created_before
+            counts.discarded += discarded - discarded_before
+            if self.use_tracemalloc:
+                allocated = tracemalloc.get_traced_memory()[0]
+                counts.allocated += allocated - allocated_before
+
+    def instrument_rule(self, rule: Rule) -> Rule:
+        """Wraps a rule, or the rules of a group."""
+        if isinstance(rule, TransformationGroup):
+            return TransformationGroup(
+                [self.instrument_rule(child) for child in rule.transformations]
+            )
+        name = getattr(rule, "name", None) or type(rule).__name__
+        counts = self.rules.setdefault(name, AllocationCounts())
+        return cast(Transformation, Tracked(rule, counts, self))
+
+    def instrument(self, step: Step, name: str = "pipeline") -> Step:
+        """Returns a copy of the step with every rule and step wrapped. Steps
+        are named by their position in the pipeline.
+        """
+        instrumented: Step
+        match step:
+            case TransformationPipeline():
+                instrumented = TransformationPipeline(
+                    [
+                        self.instrument(child, f"{name}.{i}")
+                        for i, child in enumerate(step.steps)
+                    ]
+                )
+            case Strategy():
+                instrumented = copy.copy(step)
+                for attribute, value in vars(step).items():
+                    match attribute:
+                        case "rule":
+                            value = self.instrument_rule(value)
+                        case "step":
+                            value = self.instrument(value, f"{name}.0")
+                        case "steps":
+                            value = tuple(
+                                self.instrument(child, f"{name}.{i}")
+                                for i, child in enumerate(value)
+                            )
+                    setattr(instrumented, attribute, value)
+            case _:
+                instrumented = self.instrument_rule(step)
+        counts = self.steps.setdefault(
+            f"{name} {type(step).__name__}", AllocationCounts()
+        )
+        return cast(Step, Tracked(instrumented, counts, self))
+
+    def run(self, step: Step, expr: AstNode) -> None:
+        """Applies the step to expr, recording its allocations."""
+        instrumented = self.instrument(step)
+        started = self.use_tracemalloc and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            with counting():
+                instrumented.apply_all(expr)
+        finally:
+            if started:
+                tracemalloc.stop()
+
+    def report(self) -> str:
+        lines = []
+        for title, table in [("steps", self.steps), ("rules", self.rules)]:
+            lines.append(f"{title}:")
+            for name, counts in table.items():
+                line = (
+                    f"    {name:<36} {counts.calls:8d} calls"
+                    f" {counts.created:8d} created {counts.discarded:8d} discarded"
+                )
+                if self.use_tracemalloc:
+                    line += f" {counts.allocated:10d} bytes"
+                lines.append(line)
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    pass
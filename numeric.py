@@ -0,0 +1,208 @@
+from typing import Any, Callable
+
+from astree import AstNode
+from symbols import BinaryOperator, UnaryOperator, Variable, operators
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed for vectorised evaluation.
+    np = None
+
+type Number = Any  # float or numpy.ndarray
+
+# NumPy counterparts (function, derivative) of the unary operator funcs in
+# symbols.py which only accept floats.
+array_functions: dict[str, tuple[Callable, Callable]] = (
+    {
+        "exp": (np.exp, np.exp),
+        "sin": (np.sin, np.cos),
+        "cos": (np.cos, lambda x: -np.sin(x)),
+        "ln": (np.log, lambda x: 1 / x),
+        "sq": (np.square, lambda x: 2 * x),
+    }
+    if np is not None
+    else {}
+)
+
+
+def is_array(x: Number) -> bool:
+    return np is not None and isinstance(x, np.ndarray)
+
+
+def unary(operator: UnaryOperator, x: Number, derivative: bool = False) -> Number:
+    """Applies the operator func (or its derivative) to a float or an array."""
+    func = operator.derivative if derivative else operator.func
+    if func is None:
+        raise ValueError(f"No derivative known for {operator}")
+    if is_array(x):
+        if functions := array_functions.get(operator.string):
+            return functions[derivative](x)
+        return np.vectorize(func, otypes=[float])(x)
+    return func(x)
+
+
+class Dual:
+    """Dual number value + derivative * e with e^2 = 0. The arithmetic operator
+    overloads let the BinaryOperator funcs propagate derivatives unchanged;
+    the value and derivative may be floats or NumPy arrays.
+    """
+
+    __slots__ = ("value", "derivative")
+    # Makes NumPy defer to the reflected operators, instead of broadcasting
+    # an array on the left over the Dual into an object array.
+    __array_ufunc__ = None
+
+    def __init__(self, value: Number, derivative: Number = 0.0):
+        self.value = value
+        self.derivative = derivative
+
+    def __repr__(self):
+        return f"Dual({self.value!r}, {self.derivative!r})"
+
+    def __add__(self, other: "Dual | Number"):
+        if isinstance(other, Dual):
+            return Dual(self.value + other.value, self.derivative + other.derivative)
+        return Dual(self.value + other, self.derivative)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Dual(-self.value, -self.derivative)
+
+    def __sub__(self, other: "Dual | Number"):
+        return self + -other
+
+    def __rsub__(self, other: Number):
+        return -self + other
+
+    def __mul__(self, other: "Dual | Number"):
+        if isinstance(other, Dual):
+            return Dual(
+                self.value * other.value,
+                self.derivative * other.value + self.value * other.derivative,
+            )
+        return Dual(self.value * other, self.derivative * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other: "Dual | Number"):
+        if isinstance(other, Dual):
+            return Dual(
+                self.value / other.value,
+                (self.derivative * other.value - self.value * other.derivative)
+                / (other.value * other.value),
+            )
+        return Dual(self.value / other, self.derivative / other)
+
+    def __rtruediv__(self, other: Number):
+        return Dual(
+            other / self.value,
+            -other * self.derivative / (self.value * self.value),
+        )
+
+    def __pow__(self, other: "Dual | Number"):
+        if isinstance(other, Dual):
+            value = self.value**other.value
+            log = unary(operators["ln"], self.value)  # pyright: ignore
+            return Dual(
+                value,
+                value
+                * (
+                    other.derivative * log
+                    + other.value * self.derivative / self.value
+                ),
+            )
+        # d/dx x^0 is 0, also at x = 0 where x^-1 is undefined.
+        if is_array(other):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                factor = np.where(other == 0, 0.0, other * self.value ** (other - 1))
+        elif other == 0:
+            factor = 0.0
+        else:
+            factor = other * self.value ** (other - 1)
+        return Dual(self.value**other, factor * self.derivative)
+
+    def __rpow__(self, other: Number):
+        value = other**self.value
+        log = unary(operators["ln"], other)  # pyright: ignore
+        return Dual(value, value * log * self.derivative)
+
+
+def apply_operator(operator: Any, args: list[Any]) -> Any:
+    """Applies an operator of the table in symbols.py to evaluated children.
+    Flattened sums and products with more than two children are folded left.
+    """
+    match operator:
+        case UnaryOperator():
+            (x,) = args
+            if isinstance(x, Dual):
+                return Dual(
+                    unary(operator, x.value),
+                    unary(operator, x.value, derivative=True) * x.derivative,
+                )
+            return unary(operator, x)
+        case BinaryOperator():
+            result = operator.func(args[0], args[1])
+            for arg in args[2:]:
+                result = operator.func(result, arg)
+            return result
+        case _:
+            raise ValueError(f"Cannot numerically evaluate operator {operator}")
+
+
+def evaluate_with(
+    expr: AstNode,
+    leaf: Callable[[AstNode], Any],
+    apply: Callable[[Any, list[Any]], Any] = apply_operator,
+) -> Any:
+    """Evaluates expr in one post-order pass, leaf giving the value of each
+    leaf node and apply applying an operator to the values of its children.
+    """
+    stack: list[Any] = []
+    for node in expr:
+        if node.is_leaf():
+            stack.append(leaf(node))
+        else:
+            arity = node.num_children()
+            args = stack[-arity:]
+            del stack[-arity:]
+            stack.append(apply(node.value, args))
+    return stack.pop()
+
+
+def evaluate(expr: AstNode, values: dict[Variable, Number]) -> Number:
+    """Evaluates expr with the variables set to values, which may be floats or
+    NumPy arrays of equal shape.
+    """
+
+    def leaf(node: AstNode):
+        if isinstance(node.value, Variable):
+            return values[node.value]
+        return node.value
+
+    return evaluate_with(expr, leaf)
+
+
+def evaluate_dual(
+    expr: AstNode, values: dict[Variable, Number], variable: Variable
+) -> Dual:
+    """Forward mode differentiation. Evaluates expr and its derivative w.r.t.
+    variable at values in a single pass, without building the symbolic
+    derivative.
+    """
+
+    def leaf(node: AstNode):
+        if node.value == variable:
+            return Dual(values[variable], 1.0)
+        elif isinstance(node.value, Variable):
+            return values[node.value]
+        return node.value
+
+    result = evaluate_with(expr, leaf)
+    if isinstance(result, Dual):
+        return result
+    return Dual(result, 0.0)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,18 +1,29 @@
-from typing import Sequence
+import os
+import sys
+import threading
+from functools import partial
+from typing import Sequence, cast
 
 from astree import AstNode
-from match import differentiation_rules, normalisation_patterns
 from rules import (
     CanonicalOrdering,
     Evaluation,
     Flattening,
     Simplification,
     Transformation,
-    UnFlattening,
 )
 
 
 class TransformationGroup:
+    """Applies the transformations repeatedly until none of them changes the
+    expression.
+
+    Transformations, groups and pipelines hold no mutable state: they only
+    rewrite the tree they are applied to, and the rules they share are only
+    read. So one pipeline may be applied by many threads at once, as long as
+    each thread transforms its own tree, see apply_batch.
+    """
+
     def __init__(self, transformations: Sequence[Transformation]):
         self.transformations = transformations
 
@@ -30,14 +41,17 @@ class TransformationGroup:
     def apply_all(self, expr: AstNode) -> bool:
         has_changed = False
         while True:
-            changed: bool = False
-            for sub_expr in expr:
-                changed = self.apply_root(sub_expr) or changed
+            changed = expr.rewrite(self.apply_root)
             has_changed |= changed
             if not changed:
                 break
         return has_changed
 
+    def transform(self, expr: AstNode) -> AstNode:
+        while (result := expr.rewritten(self.apply_root)) is not expr:
+            expr = result
+        return expr
+
     def apply2(self, expr: AstNode):
         while True:
             changed: bool = False
@@ -46,29 +60,349 @@ class TransformationGroup:
             if not changed:
                 break
 
+
 class TransformationPipeline:
-    def __init__(self, steps: list[Transformation | TransformationGroup]):
+    def __init__(self, steps: list["Step"]):
         self.steps = steps
 
-    def apply_all(self, expr: AstNode):
+    def apply_all(self, expr: AstNode) -> bool:
+        changed = False
         for step in self.steps:
-            step.apply_all(expr)
+            changed = step.apply_all(expr) or changed
+        return changed
 
+    def transform(self, expr: AstNode) -> AstNode:
+        for step in self.steps:
+            expr = step.transform(expr)
+        return expr
 
-normalisation_group = TransformationGroup(
-        normalisation_patterns +
-    [
-        Flattening(),
-        CanonicalOrdering(),
-        Evaluation(),
-        Simplification(),
-    ]
-)
 
-differentiation_group = TransformationGroup(differentiation_rules)
+# Rules rewrite the root of an expression with apply_root, steps rewrite the
+# whole expression with apply_all. Both return whether anything changed.
+# Steps are also persistent with transform, which leaves the expression
+# unchanged and returns the result, or the expression itself if nothing
+# changed. Only the rewritten nodes and their ancestors are copied, every
+# other subtree is shared with the expression, so many versions of a tree
+# cost memory proportional to their differences. The shared subtrees must
+# not be rewritten in place while another version is in use.
+type Rule = Transformation | TransformationGroup
+type Step = Transformation | TransformationGroup | TransformationPipeline | Strategy
+
+
+class Strategy:
+    """Traversal strategies, which decide where and how often rules are
+    applied. They are steps themselves, so they compose and can be used in a
+    TransformationPipeline.
+    """
+
+    def apply_all(self, expr: AstNode) -> bool:
+        raise NotImplementedError
+
+    def transform(self, expr: AstNode) -> AstNode:
+        raise NotImplementedError
+
+
+class BottomUpOnce(Strategy):
+    """A single post-order pass, as Transformation.apply_all."""
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+
+    def apply_all(self, expr: AstNode) -> bool:
+        return expr.rewrite(self.rule.apply_root)
+
+    def transform(self, expr: AstNode) -> AstNode:
+        return expr.rewritten(self.rule.apply_root)
+
+
+class TopDownOnce(Strategy):
+    """A single pre-order pass. A rewritten node's new children are visited,
+    not its old ones.
+    """
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+
+    def apply_all(self, expr: AstNode) -> bool:
+        changed = self.rule.apply_root(expr)
+        for child in expr.children:
+            changed = self.apply_all(child) or changed
+        if changed:
+            expr.invalidate()
+        return changed
+
+    def transform(self, expr: AstNode) -> AstNode:
+        node = expr.rewritten_root(self.rule.apply_root)
+        return node.with_children([self.transform(child) for child in node.children])
+
+
+class Innermost(Strategy):
+    """Rewrites to a normal form in a single traversal: the children are
+    normalised before their parent, and whenever the parent is rewritten its
+    new children are normalised before the rule is tried on it again.
+    """
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+
+    def apply_all(self, expr: AstNode) -> bool:
+        return self.apply_above(expr, {})
+
+    def apply_above(self, expr: AstNode, normal: dict[int, AstNode]) -> bool:
+        """Normalises expr, skipping the nodes in normal, keyed by id, which
+        must already be in normal form. normal keeps them alive, so their ids
+        cannot be reused by new nodes while expr is normalised.
+        """
+        if id(expr) in normal:
+            return False
+        changed = False
+        for child in expr.children:
+            changed = self.apply_above(child, normal) or changed
+        while self.rule.apply_root(expr):
+            changed = True
+            for child in expr.children:
+                self.apply_above(child, normal)
+        if changed:
+            expr.invalidate()
+        return changed
+
+    def transform(self, expr: AstNode) -> AstNode:
+        return self.transform_above(expr, {})
+
+    def transform_above(self, expr: AstNode, normal: dict[int, AstNode]) -> AstNode:
+        """Persistent apply_above. Every normal form found is added to normal,
+        which keeps it alive so its id is not reused, and subtrees shared
+        between rewrites or positions are only normalised once.
+        """
+        if id(expr) in normal:
+            return expr
+        node = expr.with_children(
+            [self.transform_above(child, normal) for child in expr.children]
+        )
+        while (rewritten := node.rewritten_root(self.rule.apply_root)) is not node:
+            node = rewritten.with_children(
+                [self.transform_above(child, normal) for child in rewritten.children]
+            )
+        normal[id(node)] = node
+        return node
+
+
+class Outermost(Strategy):
+    """Rewrites to a normal form by repeatedly rewriting the first outermost
+    node, in pre-order, which the rule applies to. Subtrees which end up
+    discarded are never normalised, but every rewrite restarts the search
+    from the root.
+    """
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+
+    def apply_all(self, expr: AstNode) -> bool:
+        changed = False
+        while self.apply_once(expr):
+            changed = True
+        return changed
+
+    def apply_once(self, expr: AstNode) -> bool:
+        if self.rule.apply_root(expr) or any(
+            self.apply_once(child) for child in expr.children
+        ):
+            expr.invalidate()
+            return True
+        return False
+
+    def transform(self, expr: AstNode) -> AstNode:
+        while (result := self.transform_once(expr)) is not expr:
+            expr = result
+        return expr
+
+    def transform_once(self, expr: AstNode) -> AstNode:
+        if (node := expr.rewritten_root(self.rule.apply_root)) is not expr:
+            return node
+        for i, child in enumerate(expr.children):
+            if (rewritten := self.transform_once(child)) is not child:
+                children = list(expr.children)
+                children[i] = rewritten
+                return AstNode(expr.value, children)
+        return expr
+
+
+class Repeat(Strategy):
+    """Applies the step until it changes nothing, or at most limit times."""
+
+    def __init__(self, step: Step, limit: int | None = None):
+        self.step = step
+        self.limit = limit
+
+    def apply_all(self, expr: AstNode) -> bool:
+        changed = False
+        count = 0
+        while self.limit is None or count < self.limit:
+            if not self.step.apply_all(expr):
+                break
+            changed = True
+            count += 1
+        return changed
+
+    def transform(self, expr: AstNode) -> AstNode:
+        count = 0
+        while self.limit is None or count < self.limit:
+            if (result := self.step.transform(expr)) is expr:
+                break
+            expr = result
+            count += 1
+        return expr
+
+
+class Sequential(Strategy):
+    """Applies every step in turn, as a TransformationPipeline."""
+
+    def __init__(self, *steps: Step):
+        self.steps = steps
+
+    def apply_all(self, expr: AstNode) -> bool:
+        changed = False
+        for step in self.steps:
+            changed = step.apply_all(expr) or changed
+        return changed
+
+    def transform(self, expr: AstNode) -> AstNode:
+        for step in self.steps:
+            expr = step.transform(expr)
+        return expr
+
+
+class Choice(Strategy):
+    """Applies the first step which changes the expression."""
+
+    def __init__(self, *steps: Step):
+        self.steps = steps
+
+    def apply_all(self, expr: AstNode) -> bool:
+        return any(step.apply_all(expr) for step in self.steps)
+
+    def transform(self, expr: AstNode) -> AstNode:
+        for step in self.steps:
+            if (result := step.transform(expr)) is not expr:
+                return result
+        return expr
+
+
+def build_pipelines() -> dict[str, TransformationGroup | TransformationPipeline]:
+    import match
+
+    normalisation_group = TransformationGroup(
+        match.normalisation_patterns
+        + [
+            Flattening(),
+            CanonicalOrdering(),
+            Evaluation(),
+            Simplification(),
+        ]
+    )
+
+    differentiation_group = TransformationGroup(match.differentiation_rules)
+
+    # The differentiation rules match flattened sums and products directly,
+    # see PatternMatching.matches_ac, so the input need not be unflattened.
+    # Innermost normalises in one traversal, where applying the groups
+    # directly repeats whole tree passes until nothing changes.
+    differentiation_pipeline = TransformationPipeline(
+        [Innermost(differentiation_group), Innermost(normalisation_group)]
+    )
+
+    return {
+        "normalisation_group": normalisation_group,
+        "differentiation_group": differentiation_group,
+        "differentiation_pipeline": differentiation_pipeline,
+    }
+
+
+pipeline_names = {
+    "normalisation_group",
+    "differentiation_group",
+    "differentiation_pipeline",
+}
+
+_pipelines_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> TransformationGroup | TransformationPipeline:
+    """Builds the pipelines, and with them the rule sets, on first access."""
+    if name not in pipeline_names:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _pipelines_lock:
+        if name not in globals():
+            globals().update(build_pipelines())
+    return globals()[name]
+
+
+def gil_enabled() -> bool:
+    """Returns whether the GIL is enabled, which is always the case before the
+    free-threaded builds of CPython 3.13.
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+
+def transformed(pipeline: Step, expr: AstNode) -> AstNode:
+    pipeline.apply_all(expr)
+    return expr
+
+
+def apply_batch(
+    pipeline: Step,
+    exprs: Sequence[AstNode],
+    max_workers: int | None = None,
+    processes: bool | None = None,
+) -> list[AstNode]:
+    """Applies the pipeline to every expression in parallel and returns the
+    results in order. The expressions must be distinct trees.
+
+    By default threads are used if the GIL is disabled, and processes
+    otherwise, since the transformations are pure Python. With threads the
+    expressions are transformed in place and returned, with processes the
+    results are transformed copies and the given expressions are unchanged.
+    """
+    if processes is None:
+        processes = gil_enabled()
+    max_workers = max_workers or os.cpu_count() or 1
+    # Imported here, since concurrent.futures pulls in multiprocessing and
+    # logging, which most users of the pipelines never need.
+    from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+    executor: Executor
+    if processes:
+        executor = ProcessPoolExecutor(max_workers)
+        chunksize = max(1, len(exprs) // (4 * max_workers))
+    else:
+        executor = ThreadPoolExecutor(max_workers)
+        chunksize = 1
+    with executor:
+        results = executor.map(
+            partial(transformed, pipeline), exprs, chunksize=chunksize
+        )
+        return list(results)
+
 
-differentiation_pipeline = TransformationPipeline([
-    UnFlattening(),
-    differentiation_group,
-    normalisation_group
-    ])
+def normalise_parallel(
+    expr: AstNode,
+    group: Rule | None = None,
+    max_workers: int | None = None,
+    processes: bool | None = None,
+) -> None:
+    """Normalises expr in place with Innermost(group), by default the
+    normalisation group, normalising the children of the root in parallel
+    with apply_batch. For large trees whose root is a flattened sum or
+    product. The children are normalised independently by Innermost anyway,
+    so after a final pass at the root, which skips the normalised children,
+    the result is identical to the sequential one.
+    """
+    if group is None:
+        group = cast(TransformationGroup, __getattr__("normalisation_group"))
+    strategy = Innermost(group)
+    children = apply_batch(strategy, expr.children, max_workers, processes)
+    expr.children = children
+    expr.invalidate()
+    normal = {id(node): node for child in children for node in child}
+    strategy.apply_above(expr, normal)
@@ -1,5 +1,7 @@
+from itertools import pairwise
+
 from astree import AstNode
-from symbols import BinaryOperator, Operator, UnaryOperator, Variable, operators
+from symbols import FLOAT, OPERATOR, kind, operators
 
 # TODO: replace: expr.value = other.value, expr.children = other.children with
 # a unified susbtitution mechanism which does not erase expr.
@@ -22,16 +24,17 @@ class Transformation:
 
     def apply_all(self, expr: AstNode) -> bool:
         """Recursively applies the transformation bottom up in post-order."""
-        applied = False
-        for sub_expr in expr:
-            applied |= self.apply_root(sub_expr) or applied
-        return applied
+        return expr.rewrite(self.apply_root)
+
+    def transform(self, expr: AstNode) -> AstNode:
+        """Persistent apply_all, see AstNode.rewritten."""
+        return expr.rewritten(self.apply_root)
 
 
 class Flattening(Transformation):
     def apply_root(self, expr: AstNode) -> bool:
         applied: bool = False
-        if isinstance(expr.value, Operator) and expr.value.associative == "full":
+        if kind(expr.value) == OPERATOR and expr.value.associative == "full":
             new_children: list[AstNode] = []
             for sub_expr in expr.children:
                 if expr.value == sub_expr.value:
@@ -46,7 +49,7 @@ class Flattening(Transformation):
 class UnFlattening(Transformation):
     def apply_root(self, expr: AstNode) -> bool:
         if (
-            isinstance(expr.value, Operator)
+            kind(expr.value) == OPERATOR
             and expr.value.associative == "full"
             and expr.num_children() > 2
         ):
@@ -61,29 +64,37 @@ class UnFlattening(Transformation):
         applied |= self.apply_root(expr)
         for child in expr.children:
             applied |= self.apply_all(child)
+        if applied:
+            expr.invalidate()
         return applied
 
+    def transform(self, expr: AstNode) -> AstNode:
+        node = expr.rewritten_root(self.apply_root)
+        return node.with_children([self.transform(child) for child in node.children])
+
 
 class CanonicalOrdering(Transformation):
+    """Sorts the children of commutative operators by AstNode.sort_key, a
+    total order, so structurally equal expressions get the same normal form.
+    Already sorted children are detected in one pass over their cached keys.
+    """
+
     def apply_root(self, expr: AstNode) -> bool:
-        if isinstance(expr.value, Operator) and expr.value.commutative:
-            expr_children_copy = expr.children[:]
-            expr.children.sort(key=self.expr_sort_key)
-            return expr_children_copy != expr.children
+        if kind(expr.value) == OPERATOR and expr.value.commutative:
+            keys = [child.sort_key() for child in expr.children]
+            if all(a <= b for a, b in pairwise(keys)):
+                return False
+            children = sorted(expr.children, key=AstNode.sort_key)
+            if all(a is b for a, b in zip(children, expr.children)):
+                return False
+            expr.children = children
+            return True
         else:
             return False
 
     @staticmethod
-    def expr_sort_key(expr: AstNode) -> tuple[int, float | str | int]:
-        match expr.value:
-            case float():
-                return (0, expr.value)
-            case Variable():
-                return (1, expr.value.string)
-            case Operator():
-                return (2, expr.value.precedence)
-            case _:
-                raise TypeError
+    def expr_sort_key(expr: AstNode) -> tuple:
+        return expr.sort_key()
 
 
 class Evaluation(Transformation):
@@ -95,39 +106,34 @@ class Evaluation(Transformation):
     """
 
     def apply_root(self, expr: AstNode):
-        match expr.value:
-            case UnaryOperator():
-                if isinstance(expr.children[0].value, float):
-                    expr.value = expr.value.func(expr.children[0].value)
-                    expr.children = []
-                    return True
-
-            case BinaryOperator():
-                if (num := self.num_floats(expr.children)) >= 2:
-                    floats: list[float] = [
-                        child.value
-                        for child in expr.children
-                        if isinstance(child.value, float)
-                    ]
-                    non_floats: list[AstNode] = [
-                        child
-                        for child in expr.children
-                        if not isinstance(child.value, float)
-                    ]
-
-                    result: float = expr.value.func(floats[0], floats[1])
-                    for i in range(2, num):
-                        result = expr.value.func(result, floats[i])
-
-                    if non_floats == []:
-                        expr.value = result
-                        expr.children = []
-                    else:
-                        expr.children = [AstNode.leafify(result)] + non_floats
-
-                    return True
-            case _:
-                pass
+        if kind(expr.value) != OPERATOR or (func := expr.value.func) is None:
+            return False
+
+        if expr.value.arity == 1:
+            if kind(expr.children[0].value) == FLOAT:
+                expr.value = func(expr.children[0].value)
+                expr.children = []
+                return True
+
+        elif (num := self.num_floats(expr.children)) >= 2:
+            floats: list[float] = [
+                child.value for child in expr.children if kind(child.value) == FLOAT
+            ]
+            non_floats: list[AstNode] = [
+                child for child in expr.children if kind(child.value) != FLOAT
+            ]
+
+            result: float = func(floats[0], floats[1])
+            for i in range(2, num):
+                result = func(result, floats[i])
+
+            if non_floats == []:
+                expr.value = result
+                expr.children = []
+            else:
+                expr.children = [AstNode.leafify(result)] + non_floats
+
+            return True
         return False
 
     @staticmethod
@@ -139,7 +145,7 @@ class Evaluation(Transformation):
         #         num += 1
         # return num
         for i in range(len(nodes)):
-            if not isinstance(nodes[i].value, float):
+            if kind(nodes[i].value) != FLOAT:
                 return i
         return len(nodes)
 
@@ -159,7 +165,7 @@ class Simplification(Transformation):
                 return True
             elif expr.num_children() == 1:
                 expr.value = expr.children[0].value
-                expr.children = expr.children[0].children
+                expr.children = list(expr.children[0].children)
                 return True
             else:
                 return old_length != expr.num_children()
@@ -176,7 +182,7 @@ class Simplification(Transformation):
                 return True
             elif expr.num_children() == 1:
                 expr.value = expr.children[0].value
-                expr.children = expr.children[0].children
+                expr.children = list(expr.children[0].children)
                 return True
             else:
                 return old_length != expr.num_children()
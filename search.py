@@ -0,0 +1,127 @@
+import pickle
+from typing import Self
+
+from astree import AstNode
+from match import PatternMatching, PatternVariable
+from tokens import Token
+
+type SubtermKey = tuple[Token, tuple[int, ...]]
+type HeadPath = tuple[Token, ...]
+type Occurrence = tuple[int, AstNode]
+
+
+def head_paths(expr: AstNode, depth: int) -> set[HeadPath]:
+    """Returns the sequences of node values on the downward paths from the
+    root of expr, up to depth values long. Paths stop before pattern
+    variables, so the head paths of a pattern are a subset of the head paths
+    of every expression it matches.
+    """
+    if isinstance(expr.value, PatternVariable):
+        return set()
+    paths: set[HeadPath] = {(expr.value,)}
+    if depth > 1:
+        for child in expr.children:
+            for path in head_paths(child, depth - 1):
+                paths.add((expr.value, *path))
+    return paths
+
+
+class SubtermIndex:
+    """Index of every subterm of a corpus of expressions. Structurally equal
+    subterms get the same id, like hash-consing, and each id is indexed by the
+    head paths of its subterm. Exact queries look up the id of the subterm,
+    pattern queries only run the matcher on subterms which have all the head
+    paths of the pattern.
+
+    Occurrences are (expression number, node) pairs. The expressions must not
+    be modified after they are added.
+    """
+
+    def __init__(self, depth: int = 3):
+        self.depth = depth
+        self.exprs: list[AstNode] = []
+        self.ids: dict[SubtermKey, int] = {}
+        self.occurrences: list[list[Occurrence]] = []
+        self.paths: dict[HeadPath, set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.exprs)
+
+    def add(self, expr: AstNode) -> int:
+        """Adds an expression to the corpus and returns its number."""
+        number = len(self.exprs)
+        self.exprs.append(expr)
+        ids: dict[int, int] = {}
+        for node in expr:
+            key = (node.value, tuple(ids[id(child)] for child in node.children))
+            if (subterm := self.ids.get(key)) is None:
+                subterm = len(self.occurrences)
+                self.ids[key] = subterm
+                self.occurrences.append([])
+                for path in head_paths(node, self.depth):
+                    self.paths.setdefault(path, set()).add(subterm)
+            self.occurrences[subterm].append((number, node))
+            ids[id(node)] = subterm
+        return number
+
+    def subterm_id(self, expr: AstNode) -> int | None:
+        """Returns the id of the subterm structurally equal to expr, if any."""
+        ids: dict[int, int] = {}
+        for node in expr:
+            key = (node.value, tuple(ids[id(child)] for child in node.children))
+            if (subterm := self.ids.get(key)) is None:
+                return None
+            ids[id(node)] = subterm
+        return ids[id(expr)]
+
+    def find(self, expr: AstNode) -> list[Occurrence]:
+        """Returns every occurrence of a subterm structurally equal to expr."""
+        if (subterm := self.subterm_id(expr)) is None:
+            return []
+        return list(self.occurrences[subterm])
+
+    def candidates(self, pattern: AstNode) -> set[int]:
+        """Returns the ids of the subterms which have every head path of the
+        pattern, a superset of those it matches.
+        """
+        paths = head_paths(pattern, self.depth)
+        if not paths:
+            return set(range(len(self.occurrences)))
+        # Intersect the rarest paths first.
+        candidate_sets = sorted(
+            (self.paths.get(path, set()) for path in paths), key=len
+        )
+        candidates = set(candidate_sets[0])
+        for candidate_set in candidate_sets[1:]:
+            candidates &= candidate_set
+            if not candidates:
+                break
+        return candidates
+
+    def find_pattern(self, pattern: AstNode) -> list[Occurrence]:
+        """Returns every occurrence of a subterm which pattern matches, in the
+        order of the expressions. Structurally equal subterms are matched once.
+        """
+        results: list[Occurrence] = []
+        for subterm in self.candidates(pattern):
+            occurrences = self.occurrences[subterm]
+            if PatternMatching.match(occurrences[0][1], pattern, {}):
+                results.extend(occurrences)
+        results.sort(key=lambda occurrence: occurrence[0])
+        return results
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
+    @classmethod
+    def load(cls, path: str) -> Self:
+        with open(path, "rb") as file:
+            index = pickle.load(file)
+        if not isinstance(index, cls):
+            raise TypeError(f"{path} does not contain a {cls.__name__}")
+        return index
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,370 @@
+from typing import Any, Callable, cast
+
+from astree import AstNode
+from numeric import Number, evaluate_with, is_array, unary
+from session import Session
+from symbols import BinaryOperator, Operator, UnaryOperator, Variable, operators
+
+
+class NumericRing:
+    """Arithmetic on float or NumPy array coefficients."""
+
+    def constant(self, value: float) -> Number:
+        return value
+
+    def as_float(self, a: Number) -> float | None:
+        return None if is_array(a) else a
+
+    def add(self, a: Number, b: Number) -> Number:
+        return a + b
+
+    def sub(self, a: Number, b: Number) -> Number:
+        return a - b
+
+    def mul(self, a: Number, b: Number) -> Number:
+        return a * b
+
+    def div(self, a: Number, b: Number) -> Number:
+        return a / b
+
+    def pow(self, a: Number, b: Number) -> Number:
+        return a**b
+
+    def unary(self, operator: UnaryOperator, a: Number) -> Number:
+        return unary(operator, a)
+
+
+class SymbolicRing:
+    """Arithmetic on expression coefficients. Operations on floats are folded
+    and additions of 0 and multiplications by 0 or 1 are dropped as the
+    nodes are made, and every node is interned into a Session, so the
+    coefficients share their common subterms.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def constant(self, value: float) -> AstNode:
+        return self.session.intern(AstNode.leafify(float(value)))
+
+    def as_float(self, a: AstNode) -> float | None:
+        return a.value if isinstance(a.value, float) else None
+
+    def node(self, operator: Operator, *children: AstNode) -> AstNode:
+        values = [self.as_float(child) for child in children]
+        if operator.func is not None and None not in values:
+            try:
+                result = operator.func(*values)
+            except (ArithmeticError, ValueError):
+                result = None
+            if isinstance(result, float):
+                return self.constant(result)
+        return self.session.intern(AstNode(operator, list(children)))
+
+    def add(self, a: AstNode, b: AstNode) -> AstNode:
+        if self.as_float(a) == 0:
+            return b
+        elif self.as_float(b) == 0:
+            return a
+        return self.node(operators["+"], a, b)
+
+    def sub(self, a: AstNode, b: AstNode) -> AstNode:
+        if self.as_float(b) == 0:
+            return a
+        return self.node(operators["-"], a, b)
+
+    def mul(self, a: AstNode, b: AstNode) -> AstNode:
+        if self.as_float(a) == 0 or self.as_float(b) == 0:
+            return self.constant(0.0)
+        elif self.as_float(a) == 1:
+            return b
+        elif self.as_float(b) == 1:
+            return a
+        return self.node(operators["*"], a, b)
+
+    def div(self, a: AstNode, b: AstNode) -> AstNode:
+        if self.as_float(a) == 0 or self.as_float(b) == 1:
+            return a
+        return self.node(operators["/"], a, b)
+
+    def pow(self, a: AstNode, b: AstNode) -> AstNode:
+        if self.as_float(b) == 1:
+            return a
+        return self.node(operators["^"], a, b)
+
+    def unary(self, operator: UnaryOperator, a: AstNode) -> AstNode:
+        return self.node(operator, a)
+
+
+type Ring = NumericRing | SymbolicRing
+
+
+class Series:
+    """Truncated Taylor series c_0 + c_1 t + ... + c_n t^n. The arithmetic
+    operator overloads let the BinaryOperator funcs propagate series, and
+    apply_unary uses the power series recurrences of the operators, so each
+    node of an expression costs O(n^2) coefficient operations.
+
+    constant marks series known to have no terms in t, which are multiplied
+    and raised to powers elementwise.
+    """
+
+    __slots__ = ("ring", "coefficients", "constant")
+
+    def __init__(self, ring: Ring, coefficients: list[Any], constant: bool = False):
+        self.ring = ring
+        self.coefficients = coefficients
+        self.constant = constant
+
+    def __repr__(self):
+        return f"Series({self.coefficients!r})"
+
+    @classmethod
+    def of_constant(cls, ring: Ring, value: Any, order: int) -> "Series":
+        return cls(ring, [value] + [ring.constant(0.0)] * order, constant=True)
+
+    def order(self) -> int:
+        return len(self.coefficients) - 1
+
+    def truncate(self, order: int) -> "Series":
+        return Series(self.ring, self.coefficients[: order + 1], self.constant)
+
+    def __add__(self, other: "Series") -> "Series":
+        ring = self.ring
+        return Series(
+            ring,
+            [ring.add(a, b) for a, b in zip(self.coefficients, other.coefficients)],
+            self.constant and other.constant,
+        )
+
+    def __sub__(self, other: "Series") -> "Series":
+        ring = self.ring
+        return Series(
+            ring,
+            [ring.sub(a, b) for a, b in zip(self.coefficients, other.coefficients)],
+            self.constant and other.constant,
+        )
+
+    def __mul__(self, other: "Series") -> "Series":
+        ring = self.ring
+        if other.constant:
+            b0 = other.coefficients[0]
+            return Series(
+                ring, [ring.mul(a, b0) for a in self.coefficients], self.constant
+            )
+        elif self.constant:
+            return other * self
+        a, b = self.coefficients, other.coefficients
+        return Series(ring, [self.convolve(a, b, k, 0) for k in range(len(a))])
+
+    def __truediv__(self, other: "Series") -> "Series":
+        ring = self.ring
+        a, b = self.coefficients, other.coefficients
+        if other.constant:
+            return Series(ring, [ring.div(c, b[0]) for c in a], self.constant)
+        # a = b * c, solved for c term by term.
+        c: list[Any] = []
+        for k in range(len(a)):
+            c.append(ring.div(ring.sub(a[k], self.convolve(b, c, k, 1)), b[0]))
+        return Series(ring, c)
+
+    def __pow__(self, other: "Series") -> "Series":
+        ring = self.ring
+        if not other.constant:
+            log = self.apply_unary(cast(UnaryOperator, operators["ln"]))
+            return (other * log).apply_unary(cast(UnaryOperator, operators["exp"]))
+        p = other.coefficients[0]
+        if self.constant:
+            return Series.of_constant(
+                ring, ring.pow(self.coefficients[0], p), self.order()
+            )
+        if (exponent := ring.as_float(p)) is not None and (
+            exponent.is_integer() and 0 <= exponent <= 64
+        ):
+            return self.integer_power(int(exponent))
+        # c = a^p satisfies a c' = p c a', so
+        # k a_0 c_k = sum of ((p + 1) j - k) a_j c_(k-j), which needs a_0 != 0.
+        a = self.coefficients
+        c = [ring.pow(a[0], p)]
+        for k in range(1, len(a)):
+            total = ring.constant(0.0)
+            for j in range(1, k + 1):
+                factor = ring.add(
+                    ring.mul(p, ring.constant(j)), ring.constant(j - k)
+                )
+                total = ring.add(total, ring.mul(factor, ring.mul(a[j], c[k - j])))
+            c.append(ring.div(total, ring.mul(ring.constant(k), a[0])))
+        return Series(ring, c)
+
+    def integer_power(self, exponent: int) -> "Series":
+        result = Series.of_constant(self.ring, self.ring.constant(1.0), self.order())
+        base = self
+        while exponent:
+            if exponent & 1:
+                result = result * base
+            exponent >>= 1
+            if exponent:
+                base = base * base
+        return result
+
+    def convolve(self, a: list[Any], b: list[Any], k: int, start: int) -> Any:
+        """Returns the sum of a_j b_(k-j) for j from start to k."""
+        ring = self.ring
+        total = ring.constant(0.0)
+        for j in range(start, k + 1):
+            total = ring.add(total, ring.mul(a[j], b[k - j]))
+        return total
+
+    def integrate(self, derivative: list[Any], c0: Any) -> list[Any]:
+        """Returns the coefficients of f(a) from f(a_0) and those of f'(a),
+        using c' = f'(a) a', i.e. k c_k = sum of j a_j d_(k-j).
+        """
+        ring = self.ring
+        a = self.coefficients
+        c = [c0]
+        for k in range(1, len(a)):
+            total = ring.constant(0.0)
+            for j in range(1, k + 1):
+                term = ring.mul(ring.mul(ring.constant(j), a[j]), derivative[k - j])
+                total = ring.add(total, term)
+            c.append(ring.div(total, ring.constant(k)))
+        return c
+
+    def apply_unary(self, operator: UnaryOperator) -> "Series":
+        ring = self.ring
+        a = self.coefficients
+        if self.constant:
+            return Series.of_constant(ring, ring.unary(operator, a[0]), self.order())
+        match operator.string:
+            case "sq":
+                return self * self
+            case "exp":
+                # c' = c a', so k c_k = sum of j a_j c_(k-j).
+                c: list[Any] = [ring.unary(operator, a[0])]
+                for k in range(1, len(a)):
+                    total = ring.constant(0.0)
+                    for j in range(1, k + 1):
+                        term = ring.mul(ring.mul(ring.constant(j), a[j]), c[k - j])
+                        total = ring.add(total, term)
+                    c.append(ring.div(total, ring.constant(k)))
+                return Series(ring, c)
+            case "sin" | "cos":
+                s, co = self.sin_cos()
+                return Series(ring, s if operator.string == "sin" else co)
+            case "ln":
+                # a c' = a', so k a_0 c_k = k a_k - sum of j c_j a_(k-j).
+                c = [ring.unary(operator, a[0])]
+                for k in range(1, len(a)):
+                    total = ring.mul(ring.constant(k), a[k])
+                    for j in range(1, k):
+                        term = ring.mul(ring.mul(ring.constant(j), c[j]), a[k - j])
+                        total = ring.sub(total, term)
+                    c.append(ring.div(total, ring.mul(ring.constant(k), a[0])))
+                return Series(ring, c)
+        if operator.symbolic_derivative is None:
+            raise ValueError(f"No series expansion known for {operator}")
+        c0 = ring.unary(operator, a[0])
+        if self.order() == 0:
+            return Series(ring, [c0])
+        # Expand the derivative f'(a), one order lower, in terms of series of
+        # the operators it is made of.
+        lower = self.truncate(self.order() - 1)
+
+        def leaf(node: AstNode) -> Series:
+            if isinstance(node.value, Variable):
+                return lower
+            return Series.of_constant(ring, ring.constant(node.value), lower.order())
+
+        derivative = series_of(AstNode.astify(operator.symbolic_derivative), leaf)
+        return Series(ring, self.integrate(derivative.coefficients, c0))
+
+    def sin_cos(self) -> tuple[list[Any], list[Any]]:
+        """Returns the coefficients of sin(a) and cos(a), computed together
+        since sin' = cos and cos' = -sin.
+        """
+        ring = self.ring
+        a = self.coefficients
+        s = [ring.unary(operators["sin"], a[0])]  # pyright: ignore
+        co = [ring.unary(operators["cos"], a[0])]  # pyright: ignore
+        for k in range(1, len(a)):
+            sin_total, cos_total = ring.constant(0.0), ring.constant(0.0)
+            for j in range(1, k + 1):
+                ja = ring.mul(ring.constant(j), a[j])
+                sin_total = ring.add(sin_total, ring.mul(ja, co[k - j]))
+                cos_total = ring.add(cos_total, ring.mul(ja, s[k - j]))
+            s.append(ring.div(sin_total, ring.constant(k)))
+            co.append(ring.div(cos_total, ring.constant(-k)))
+        return s, co
+
+
+def apply_series(operator: Any, args: list[Series]) -> Series:
+    match operator:
+        case UnaryOperator():
+            return args[0].apply_unary(operator)
+        case BinaryOperator():
+            result = operator.func(args[0], args[1])
+            for arg in args[2:]:
+                result = operator.func(result, arg)
+            return result
+        case _:
+            raise ValueError(f"No series expansion known for {operator}")
+
+
+def series_of(expr: AstNode, leaf: Callable[[AstNode], Series]) -> Series:
+    return evaluate_with(expr, leaf, apply_series)
+
+
+def taylor(
+    expr: AstNode,
+    variable: Variable,
+    point: Number,
+    order: int,
+    values: dict[Variable, Number] | None = None,
+) -> list[Number]:
+    """Returns the Taylor coefficients c_0, ..., c_order of expr in variable
+    around point, so expr is approximately the sum of c_k (variable - point)^k,
+    in a single pass over expr. The other variables are set to values, and
+    the point and values may be NumPy arrays of equal shape.
+    """
+    ring = NumericRing()
+    values = values or {}
+
+    def leaf(node: AstNode) -> Series:
+        if node.value == variable:
+            return Series(ring, ([point, 1.0] + [0.0] * (order - 1))[: order + 1])
+        elif isinstance(node.value, Variable):
+            return Series.of_constant(ring, values[node.value], order)
+        return Series.of_constant(ring, node.value, order)
+
+    return series_of(expr, leaf).coefficients
+
+
+def taylor_symbolic(
+    expr: AstNode,
+    variable: Variable,
+    order: int,
+    point: AstNode | None = None,
+    session: Session | None = None,
+) -> list[AstNode]:
+    """Returns the Taylor coefficients of expr in variable as normalised
+    expressions. The point defaults to the variable itself, giving the
+    coefficients f^(k)(x) / k!. The coefficients share subterms through the
+    session and must be copied before being modified in place.
+    """
+    session = session or Session()
+    ring = SymbolicRing(session)
+    point = session.intern(point or AstNode.leafify(variable))
+
+    def leaf(node: AstNode) -> Series:
+        if node.value == variable:
+            coefficients = [point, ring.constant(1.0)]
+            coefficients += [ring.constant(0.0)] * (order - 1)
+            return Series(ring, coefficients[: order + 1])
+        return Series.of_constant(ring, session.intern(node), order)
+
+    coefficients = series_of(expr, leaf).coefficients
+    return [session.normalise(coefficient) for coefficient in coefficients]
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+from astree import AstNode
+from derivatives import differentiate
+from numeric import evaluate
+from symbols import Variable
+
+# Requests and responses are JSON objects, one per line:
+#
+#     {"id": 1, "op": "differentiate", "expr": "x * sin(x)", "variable": "x"}
+#     {"id": 1, "result": "..."}
+#
+# op is one of parse, normalise, differentiate and evaluate, which also takes
+# "values": {"x": 0.5}. Failed requests are answered with {"id", "error"}.
+type Job = tuple[str, str, str | None, tuple[tuple[str, float], ...]]
+
+
+def compute(job: Job) -> str | float:
+    """Runs a single request. Expressions are returned in infix notation."""
+    op, string, variable, values = job
+    expr = AstNode.astify(string)
+    match op:
+        case "parse":
+            return expr.infix()
+        case "normalise":
+            from pipeline import normalisation_group
+
+            normalisation_group.apply_all(expr)
+            return expr.infix()
+        case "differentiate":
+            if variable is None:
+                raise ValueError("differentiate needs a variable")
+            return differentiate(expr, Variable(variable)).infix()
+        case "evaluate":
+            return float(
+                evaluate(expr, {Variable(name): value for name, value in values})
+            )
+        case _:
+            raise ValueError(f"Unknown op {op!r}")
+
+
+def compute_batch(jobs: list[Job]) -> list[tuple[bool, str | float]]:
+    """Runs the jobs in one worker, returning (ok, result or error message)."""
+    results: list[tuple[bool, str | float]] = []
+    for job in jobs:
+        try:
+            results.append((True, compute(job)))
+        except Exception as error:
+            results.append((False, f"{type(error).__name__}: {error}"))
+    return results
+
+
+def warm() -> None:
+    """Builds the rule sets and pipelines in a new worker."""
+    import pipeline
+
+    pipeline.differentiation_pipeline
+
+
+def parse_job(request: dict[str, Any]) -> Job:
+    values = request.get("values") or {}
+    if not isinstance(values, dict):
+        raise ValueError("values must be an object")
+    return (
+        str(request["op"]),
+        str(request["expr"]),
+        None if request.get("variable") is None else str(request["variable"]),
+        tuple(sorted((str(name), float(value)) for name, value in values.items())),
+    )
+
+
+class Server:
+    """Asynchronous front end to a pool of workers. Concurrent identical
+    requests are coalesced into one job, jobs arriving within batch_delay of
+    each other are sent to the pool together, and results are kept in a
+    shared least recently used cache.
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        processes: bool = True,
+        batch_size: int = 64,
+        batch_delay: float = 0.002,
+        cache_size: int = 10_000,
+    ):
+        self.executor: Executor
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers, initializer=warm)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers, initializer=warm)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.cache_size = cache_size
+        self.cache: OrderedDict[Job, str | float] = OrderedDict()
+        self.in_flight: dict[Job, asyncio.Future[str | float]] = {}
+        self.queue: asyncio.Queue[Job] | None = None
+        self.batcher: asyncio.Task[None] | None = None
+        self.running: set[asyncio.Task[None]] = set()
+        self.stats = {"requests": 0, "cache hits": 0, "coalesced": 0, "batches": 0}
+
+    async def submit(self, job: Job) -> str | float:
+        """Returns the result of the job, raising ValueError if it failed."""
+        self.stats["requests"] += 1
+        if job in self.cache:
+            self.stats["cache hits"] += 1
+            self.cache.move_to_end(job)
+            return self.cache[job]
+        if (future := self.in_flight.get(job)) is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.batcher = asyncio.create_task(self.run_batches())
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[job] = future
+        self.queue.put_nowait(job)
+        return await asyncio.shield(future)
+
+    async def run_batches(self) -> None:
+        assert self.queue is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(jobs) < self.batch_size:
+                try:
+                    timeout = deadline - loop.time()
+                    jobs.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except TimeoutError:
+                    break
+            self.stats["batches"] += 1
+            task = loop.create_task(self.run_batch(jobs))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run_batch(self, jobs: list[Job]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, compute_batch, jobs)
+        except Exception as error:
+            results = [(False, f"{type(error).__name__}: {error}")] * len(jobs)
+        for job, (ok, result) in zip(jobs, results):
+            future = self.in_flight.pop(job)
+            if ok:
+                self.cache[job] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                future.set_result(result)
+            else:
+                future.set_exception(ValueError(result))
+            # Mark the exception as retrieved if every waiter has gone.
+            future.exception()
+
+    async def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        response: dict[str, Any] = {"id": request.get("id")}
+        try:
+            response["result"] = await self.submit(parse_job(request))
+        except (KeyError, TypeError, ValueError) as error:
+            response["error"] = str(error)
+        return response
+
+    async def serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answers the requests of a connection concurrently, in the order in
+        which they complete.
+        """
+        tasks: set[asyncio.Task[None]] = set()
+
+        async def answer(line: bytes) -> None:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be an object")
+            except ValueError as error:
+                response = {"id": None, "error": str(error)}
+            else:
+                response = await self.handle(request)
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0, path: str | None = None
+    ) -> asyncio.Server:
+        """Starts listening on a TCP port, or a Unix socket if path is given."""
+        if path is not None:
+            return await asyncio.start_unix_server(self.serve_connection, path)
+        return await asyncio.start_server(self.serve_connection, host, port)
+
+    def close(self) -> None:
+        if self.batcher is not None:
+            self.batcher.cancel()
+        self.executor.shutdown(cancel_futures=True)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = Server(args.workers, not args.threads)
+    listener = await server.start(args.host, args.port, args.unix)
+    for sock in listener.sockets:
+        print(f"listening on {sock.getsockname()}", flush=True)
+    try:
+        await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Local differentiation service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on a Unix socket instead")
+    parser.add_argument("--workers", type=int, help="size of the worker pool")
+    parser.add_argument(
+        "--threads", action="store_true", help="use threads instead of processes"
+    )
+    try:
+        asyncio.run(serve(parser.parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
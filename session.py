@@ -0,0 +1,98 @@
+from astree import AstNode
+from derivatives import derivative_tree
+from pipeline import TransformationGroup
+from symbols import Variable
+from tokens import Token
+
+type SubtermKey = tuple[Token, tuple[int, ...]]
+
+
+class Session:
+    """Shares work between the expressions of a batch. Every subterm is
+    interned into one table of canonical nodes, so structurally equal subterms
+    of any of the expressions are the same node, and the normal form and
+    derivatives of each canonical node are computed once and cached. Memory
+    and rewriting time scale with the number of distinct subterms.
+
+    The returned trees share nodes with the table and with each other, and
+    must be copied before being modified in place.
+    """
+
+    def __init__(
+        self,
+        normalisation: TransformationGroup | None = None,
+        differentiation: TransformationGroup | None = None,
+    ):
+        if normalisation is None:
+            from pipeline import normalisation_group as normalisation
+        if differentiation is None:
+            from pipeline import differentiation_group as differentiation
+        self.normalisation = normalisation
+        self.differentiation = differentiation
+        self.table: dict[SubtermKey, AstNode] = {}
+        # Ids of the canonical nodes, which the table keeps alive.
+        self.canonical: set[int] = set()
+        self.normal_forms: dict[int, AstNode] = {}
+        self.derivatives: dict[int, AstNode] = {}
+
+    def size(self) -> int:
+        """Returns the number of distinct subterms."""
+        return len(self.table)
+
+    def intern(self, expr: AstNode) -> AstNode:
+        """Returns the canonical node structurally equal to expr, adding the
+        subterms of expr which are not in the table yet. expr is not modified.
+        """
+        if id(expr) in self.canonical:
+            return expr
+        children = [self.intern(child) for child in expr.children]
+        key = (expr.value, tuple(id(child) for child in children))
+        if (node := self.table.get(key)) is None:
+            node = AstNode(expr.value, children)
+            self.table[key] = node
+            self.canonical.add(id(node))
+        return node
+
+    def parse(self, string: str) -> AstNode:
+        return self.intern(AstNode.astify(string))
+
+    def reduce(
+        self, node: AstNode, group: TransformationGroup, cache: dict[int, AstNode]
+    ) -> AstNode:
+        """Returns the canonical normal form of a canonical node under group,
+        innermost first. Normal forms of subterms are looked up in cache, so
+        each distinct subterm is only rewritten once. Rules rewrite a new root
+        node over canonical children and never modify canonical nodes.
+        """
+        if (result := cache.get(id(node))) is not None:
+            return result
+        tree = AstNode(
+            node.value, [self.reduce(child, group, cache) for child in node.children]
+        )
+        while group.apply_root(tree):
+            tree = AstNode(
+                tree.value,
+                [
+                    self.reduce(self.intern(child), group, cache)
+                    for child in tree.children
+                ],
+            )
+        result = self.intern(tree)
+        cache[id(node)] = result
+        cache[id(result)] = result
+        return result
+
+    def normalise(self, expr: AstNode) -> AstNode:
+        return self.reduce(self.intern(expr), self.normalisation, self.normal_forms)
+
+    def differentiate(self, expr: AstNode, variable: Variable) -> AstNode:
+        """Returns the normalised derivative of expr w.r.t. variable. The
+        derivatives of subterms shared with earlier expressions are reused.
+        """
+        derivative = self.intern(derivative_tree(expr, variable, share=True))
+        expanded = self.reduce(derivative, self.differentiation, self.derivatives)
+        return self.reduce(expanded, self.normalisation, self.normal_forms)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,11 +1,36 @@
 import math
 from typing import Any, Callable, Self
 
+# Kind tags of node values. kind looks them up by type, so hot loops can
+# dispatch on a small integer instead of a chain of isinstance checks.
+FLOAT, VARIABLE, PATTERN_VARIABLE, OPERATOR = range(4)
+
+kinds: dict[type, int] = {float: FLOAT}
+
+
+def kind(value: Any) -> int:
+    try:
+        return kinds[type(value)]
+    except KeyError:
+        # Subclasses of float, e.g. np.float64, are looked up by isinstance
+        # and then added to the table.
+        for value_type, value_kind in list(kinds.items()):
+            if isinstance(value, value_type):
+                kinds[type(value)] = value_kind
+                return value_kind
+        raise TypeError(f"{value!r} is not a node value") from None
+
 
 class Symbol:
+    kind: int
+
     def __init__(self, string: str):
         self.string = string
 
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        kinds[cls] = cls.kind
+
     def __eq__(self, other: Any):
         if type(self) is type(other):
             return self.string == other.string
@@ -17,10 +42,21 @@ class Symbol:
 
 
 class Variable(Symbol):
+    kind = VARIABLE
+
     def __hash__(self):
         return hash(self.string)
 
+
 class Operator(Symbol):
+    """Operators are compared by their opcode, given when they are registered
+    with register_operator.
+    """
+
+    kind = OPERATOR
+    opcode: int | None = None
+    func: Callable[..., float] | None = None
+
     def __init__(
         self,
         string: str,
@@ -35,6 +71,25 @@ class Operator(Symbol):
         self.associative = associative
         self.commutative = commutative
 
+    def __eq__(self, other: Any):
+        if self is other:
+            return True
+        elif not isinstance(other, Operator) or type(self) is not type(other):
+            return False
+        elif self.opcode is None or other.opcode is None:
+            return self.string == other.string
+        else:
+            return self.opcode == other.opcode
+
+    def __hash__(self):
+        return hash(self.string)
+
+    def __reduce__(self):
+        """Registered operators are pickled by reference to the registry, so
+        their funcs need not be picklable and unpickling keeps them unique.
+        """
+        return registered_operator, (self.string,)
+
     def __ge__(self, other: Self):
         return self.precedence >= other.precedence
 
@@ -48,10 +103,18 @@ class UnaryOperator(Operator):
         associative: str,
         commutative: bool,
         func: Callable[[float], float],
+        derivative: Callable[[float], float] | None = None,
+        symbolic_derivative: str | None = None,
     ):
+        """derivative is the numeric derivative of func. symbolic_derivative
+        is the derivative as an infix expression in f, e.g. "cos(f)" for sin,
+        from which the chain rule for the operator is made.
+        """
         super().__init__(string, arity, precedence, associative, commutative)
         self.arity = 1
         self.func = func
+        self.derivative = derivative
+        self.symbolic_derivative = symbolic_derivative
 
 
 class BinaryOperator(Operator):
@@ -69,21 +132,50 @@ class BinaryOperator(Operator):
         self.func = func
 
 
-operators: dict[str, Operator] = {
-    "+": BinaryOperator("+", 2, 1, "full", True, lambda x, y: x + y),
-    "-": BinaryOperator("-", 2, 1, "left", False, lambda x, y: x - y),
-    "*": BinaryOperator("*", 2, 2, "full", True, lambda x, y: x * y),
-    "/": BinaryOperator("/", 2, 2, "left", False, lambda x, y: x / y),
-    "^": BinaryOperator("^", 2, 3, "right", False, lambda x, y: x ** y),
-    "sq": UnaryOperator("sq", 1, 4, "right", False, lambda x: x * x),
-    "exp": UnaryOperator("exp", 1, 4, "right", False, math.exp),
-    "sin": UnaryOperator("sin", 1, 4, "right", False, math.sin),
-    "cos": UnaryOperator("cos", 1, 4, "right", False, math.cos),
-    "ln": UnaryOperator("ln", 1, 4, "right", False, math.log),
-    "D": Operator("D", 2, 5, "left", False),
-    "(": Operator("(", 0, 0, "", False),
-    ")": Operator(")", 0, 0, "", False),
-}
+operator_table: list[Operator] = []  # indexed by opcode
+operators: dict[str, Operator] = {}
+registration_hooks: list[Callable[[Operator], None]] = []
+
+
+def registered_operator(string: str) -> Operator:
+    return operators[string]
+
+
+def register_operator(operator: Operator) -> Operator:
+    """Gives the operator the next opcode and makes it known to the tokeniser
+    under its string. Hooks, e.g. the one adding chain rules in match.py, are
+    called so new operators need no changes to the core modules.
+    """
+    operator.opcode = len(operator_table)
+    operator_table.append(operator)
+    operators[operator.string] = operator
+    for hook in registration_hooks:
+        hook(operator)
+    return operator
+
+
+for builtin in [
+    BinaryOperator("+", 2, 1, "full", True, lambda x, y: x + y),
+    BinaryOperator("-", 2, 1, "left", False, lambda x, y: x - y),
+    BinaryOperator("*", 2, 2, "full", True, lambda x, y: x * y),
+    BinaryOperator("/", 2, 2, "left", False, lambda x, y: x / y),
+    BinaryOperator("^", 2, 3, "right", False, lambda x, y: x ** y),
+    UnaryOperator(
+        "sq", 1, 4, "right", False, lambda x: x * x, lambda x: 2 * x, "2 * f"
+    ),
+    UnaryOperator("exp", 1, 4, "right", False, math.exp, math.exp, "exp(f)"),
+    UnaryOperator("sin", 1, 4, "right", False, math.sin, math.cos, "cos(f)"),
+    UnaryOperator(
+        "cos", 1, 4, "right", False, math.cos, lambda x: -math.sin(x), "-1 * sin(f)"
+    ),
+    UnaryOperator(
+        "ln", 1, 4, "right", False, math.log, lambda x: 1 / x, "f ^ -1"
+    ),
+    Operator("D", 2, 5, "left", False),
+    Operator("(", 0, 0, "", False),
+    Operator(")", 0, 0, "", False),
+]:
+    register_operator(builtin)
 
 if __name__ == "__main__":
     pass
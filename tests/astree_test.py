@@ -1,5 +1,13 @@
+import io
+import math
+
 from tokens import Variable, Token
-from astree import AstNode
+from astree import AstNode, LazyDerivative
+from derivatives import differentiate
+from numeric import evaluate
+from pipeline import differentiation_group, normalisation_group
+from rules import Flattening, Simplification
+from symbols import operators
 import pytest
 from tests.tokens_test import test_expressions_full
 
@@ -53,3 +61,185 @@ def test_copy(asttree: AstNode):
 @pytest.mark.parametrize("asttree, varis", asttree_varis)
 def test_variables(asttree: AstNode, varis: set[Variable]):
     assert asttree.variables() == varis
+
+
+def test_lazy_derivative():
+    x = Variable("x")
+    expr = AstNode.astify("(x * x) * sin(x)")
+    derivative = LazyDerivative.of(x, expr)
+    assert not derivative._expanded
+    assert derivative.value == operators["+"]
+    left, right = derivative.children
+    assert isinstance(left.children[0], LazyDerivative)
+    assert not left.children[0]._expanded
+    assert not right.children[1]._expanded
+    expected = AstNode.astify("x D ((x * x) * sin(x))")
+    differentiation_group.apply_all(expected)
+    assert derivative.is_equal(expected)
+    assert left.children[0]._expanded
+
+
+def test_lazy_derivative_input_unchanged():
+    x = Variable("x")
+    expr = AstNode.astify("(x * y) * sin(x - 1)")
+    derivative = LazyDerivative.of(x, expr)
+    normalisation_group.apply_all(derivative)
+    assert expr.is_equal(AstNode.astify("(x * y) * sin(x - 1)"))
+
+
+def test_lazy_derivative_subtraction_division():
+    x = Variable("x")
+    expr = AstNode.astify("sin(x - 1) / x")
+    derivative = LazyDerivative.of(x, expr)
+    values = {x: 0.7}
+    assert math.isclose(
+        evaluate(derivative, values), evaluate(differentiate(expr, x), values)
+    )
+
+
+def test_lazy_derivative_copy():
+    x = Variable("x")
+    derivative = LazyDerivative.of(x, AstNode.astify("x * 2"))
+    copy = derivative.copy()
+    assert type(copy) is AstNode
+    assert copy.is_equal(AstNode.astify("(1 * 2) + (x * 0)"))
+    assert not any(isinstance(node, LazyDerivative) for node in copy)
+
+
+infix_exprs = [
+    "3 * ( x + 2 ) - sin ( y )",
+    "a - ( b - c )",
+    "( a - b ) - c",
+    "a ^ ( b ^ c )",
+    "( a + b ) * c ^ -1.0",
+    "x D ( x * y )",
+    "sin ( x + y ) ^ 2.0",
+    "exp ( ln ( sq ( x ) ) ) / ( y * 1e-05 )",
+]
+
+
+@pytest.mark.parametrize("string", infix_exprs)
+def test_infix_round_trip(string: str):
+    expr = AstNode.astify(string)
+    assert AstNode.astify(expr.infix()).is_equal(expr)
+
+
+@pytest.mark.parametrize("asttree", asttree)
+def test_infix_round_trip_full(asttree: AstNode):
+    assert AstNode.astify(asttree.infix()).is_equal(asttree)
+
+
+@pytest.mark.parametrize("value", [1e16, 1.5e20, -1e300, 1e-20, -2.5e-300, 0.1])
+def test_infix_round_trip_floats(value: float):
+    expr = AstNode(
+        operators["+"],
+        [
+            AstNode(operators["*"], [AstNode.leafify(value), AstNode.astify("x")]),
+            AstNode.leafify(value),
+        ],
+    )
+    assert "e+" not in expr.infix()
+    assert AstNode.astify(expr.infix()).is_equal(expr)
+
+
+def test_infix_minimal_parentheses():
+    assert AstNode.astify("(a * b) + (c * d)").infix() == "a * b + c * d"
+    assert AstNode.astify("a - (b + c)").infix() == "a - ( b + c )"
+    assert AstNode.astify("(2) ^ (x)").infix() == "2.0 ^ x"
+
+
+def test_infix_flattened():
+    expr = AstNode.astify("a + b + c")
+    Flattening().apply_all(expr)
+    assert expr.infix() == "a + b + c"
+
+
+def test_write_infix_deep():
+    expr = AstNode.astify("x")
+    for _ in range(5000):
+        expr = AstNode(operators["sin"], [expr])
+    stream = io.StringIO()
+    expr.write_infix(stream)
+    assert stream.getvalue().startswith("sin ( sin (")
+    assert stream.getvalue().count("x") == 1
+
+
+def test_free_variables_cached():
+    expr = AstNode.astify("x * sin(y) + 2")
+    assert expr.free_variables() == {Variable("x"), Variable("y")}
+    assert expr.children[1]._free_variables == frozenset()
+    assert expr.children[0]._free_variables == {Variable("x"), Variable("y")}
+
+
+def test_free_variables_invalidated():
+    expr = AstNode.astify("(x * 0) + y")
+    assert expr.variables() == {Variable("x"), Variable("y")}
+    normalisation_group.apply_all(expr)
+    assert expr.variables() == {Variable("y")}
+
+
+def test_sort_key():
+    a = AstNode.astify("sin(x) * cos(y)")
+    b = AstNode.astify("sin(x) * cos(y)")
+    assert a.sort_key() == b.sort_key()
+    assert a.children[0]._sort_key is not None
+    assert AstNode.astify("sin(x)").sort_key() != AstNode.astify("cos(x)").sort_key()
+    assert AstNode.astify("x * y").sort_key() < AstNode.astify("x * z").sort_key()
+
+
+def test_sort_key_invalidated():
+    expr = AstNode.astify("(x * 0) + y")
+    key = expr.sort_key()
+    normalisation_group.apply_all(expr)
+    assert expr.sort_key() != key
+    assert expr.sort_key() == AstNode.astify("y").sort_key()
+
+
+def test_rewritten():
+    expr = AstNode.astify("sin(x * y) + (0 + z)")
+    simplification = Simplification()
+    result = expr.rewritten(simplification.apply_root)
+    assert result.is_equal(AstNode.astify("sin(x * y) + z"))
+    assert expr.is_equal(AstNode.astify("sin(x * y) + (0 + z)"))
+    assert result.children[0] is expr.children[0]
+    assert result.rewritten(simplification.apply_root) is result
+
+
+def test_substitute_variables():
+    expr = AstNode.astify("x * sin(y) + exp(2)")
+    constant = expr.children[1]
+    constant.free_variables()
+    # Fails if the substitution descends into the constant subtree.
+    constant.children = None  # pyright: ignore
+    expr.substitute_variables({Variable("y"): AstNode.astify("z + 1")})
+    assert expr.variables() == {Variable("x"), Variable("z")}
+    assert expr.children[0].children[1].children[0].infix() == "z + 1.0"
+
+
+def test_compose():
+    x, y = Variable("x"), Variable("y")
+    expr = AstNode.astify("x * sin(y) + exp(2)")
+    composed = expr.compose({x: AstNode.astify("y"), y: AstNode.astify("x")})
+    assert composed.is_equal(AstNode.astify("y * sin(x) + exp(2)"))
+    assert expr.is_equal(AstNode.astify("x * sin(y) + exp(2)"))
+    assert composed.children[1] is not expr.children[1]
+    zero = AstNode.leafify(0.0)
+    assert expr.compose({y: zero}).is_equal(AstNode.astify("x * sin(0) + exp(2)"))
+
+
+def test_compose_share():
+    x = Variable("x")
+    expr = AstNode.astify("x * x + exp(2)")
+    substitution = AstNode.astify("a + 1")
+    shared = expr.compose({x: substitution}, share=True)
+    assert shared.children[1] is expr.children[1]
+    assert shared.children[0].children[0] is substitution
+    assert shared.children[0].children[1] is substitution
+    assert expr.compose({}, share=True) is expr
+
+    copied = expr.compose({x: substitution})
+    first, second = copied.children[0].children
+    assert first is not substitution and first is not second
+    assert first.children is not second.children
+    first.children.append(AstNode.leafify(2.0))
+    assert second.is_equal(substitution)
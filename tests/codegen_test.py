@@ -0,0 +1,112 @@
+import importlib.util
+import math
+from pathlib import Path
+
+import pytest
+
+from astree import AstNode
+from codegen import c_source, compile_python, python_source
+from derivatives import differentiate
+from numeric import evaluate
+from symbols import Variable
+
+x, y = Variable("x"), Variable("y")
+
+exprs = [
+    "3 * x ^ 2 - y / 2",
+    "sin(x * y) * sin(x * y) + exp(-1 * x)",
+    "ln(sq(x) + 1) - cos(2 * x)",
+    "-2 ^ 3 * x",
+]
+
+
+@pytest.mark.parametrize("string", exprs)
+def test_compile_python(string: str):
+    expr = AstNode.astify(string)
+    f = compile_python(expr, args=[x, y])
+    assert math.isclose(f(0.7, 1.3), evaluate(expr, {x: 0.7, y: 1.3}))
+
+
+def test_common_subexpressions():
+    expr = AstNode.astify("sin(x * y) * sin(x * y)")
+    source = python_source(expr)
+    assert source.count("math.sin") == 1
+    assert source.count("x * y") == 1
+
+
+def test_multiple_outputs():
+    expr = AstNode.astify("x ^ 3 * sin(x)")
+    gradient = [expr, differentiate(expr, x)]
+    f = compile_python(gradient)
+    value, derivative = f(2.0)
+    assert math.isclose(value, 8 * math.sin(2.0))
+    assert math.isclose(derivative, 12 * math.sin(2.0) + 8 * math.cos(2.0))
+
+
+def test_python_source_importable(tmp_path: Path):
+    path = tmp_path / "kernel.py"
+    path.write_text(python_source(AstNode.astify("exp(x) + y"), "kernel"))
+    spec = importlib.util.spec_from_file_location("kernel", path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.kernel(0.0, 2.0) == 3.0
+
+
+def test_c_source():
+    source = c_source(AstNode.astify("x ^ ln(y) + -1"), "kernel")
+    assert "#include <math.h>" in source
+    assert "double kernel(double x, double y)" in source
+    assert "pow(x, _t0)" in source
+    assert "log(y)" in source
+    assert "(-1.0)" in source
+    source = c_source([AstNode.astify("x"), AstNode.astify("2 * x")])
+    assert "void f(double x, double *out)" in source
+    assert "out[1] = _t0;" in source
+
+
+def test_unexpanded_derivative():
+    with pytest.raises(ValueError):
+        python_source(AstNode.astify("x D y"))
+
+
+def test_temporaries_do_not_clash():
+    t0, t1 = Variable("t0"), Variable("t1")
+    expr = AstNode.astify("sin(t1) * t0 + t1")
+    f = compile_python(expr, args=[t0, t1])
+    assert math.isclose(f(2.0, 1.5), evaluate(expr, {t0: 2.0, t1: 1.5}))
+
+
+@pytest.mark.parametrize("name", ["lambda", "if", "math", "_t0"])
+def test_reserved_names(name: str):
+    with pytest.raises(ValueError):
+        python_source(AstNode.astify(f"{name} + x"))
+    with pytest.raises(ValueError):
+        python_source(AstNode.astify("x + 1"), args=[Variable(name), x])
+
+
+def test_c_reserved_names():
+    with pytest.raises(ValueError):
+        c_source(AstNode.astify("out * 2"))
+    with pytest.raises(ValueError):
+        c_source(AstNode.astify("double + pow"))
+
+
+@pytest.mark.parametrize("name", ["2f", "my-kernel", "lambda", "math"])
+def test_invalid_python_function_name(name: str):
+    with pytest.raises(ValueError):
+        python_source(AstNode.astify("x + 1"), name)
+
+
+@pytest.mark.parametrize("name", ["2f", "my-kernel", "double", "sin"])
+def test_invalid_c_function_name(name: str):
+    with pytest.raises(ValueError):
+        c_source(AstNode.astify("x + 1"), name)
+
+
+def test_missing_args():
+    expr = AstNode.astify("x * y + z")
+    with pytest.raises(ValueError, match="z"):
+        python_source(expr, args=[x, y])
+    with pytest.raises(ValueError, match="y, z"):
+        c_source(expr, args=[x])
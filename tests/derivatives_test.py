@@ -0,0 +1,124 @@
+import math
+
+import pytest
+
+from astree import AstNode
+from derivatives import PartialDerivatives, differentiate, jacobian, multi_index
+from numeric import evaluate
+from symbols import Variable, operators
+
+x, y = Variable("x"), Variable("y")
+
+
+@pytest.fixture
+def partials():
+    return PartialDerivatives(AstNode.astify("x ^ 3 * sin(y)"))
+
+
+def test_multi_index():
+    assert multi_index([y, x, y]) == ((x, 1), (y, 2))
+    assert multi_index([]) == ()
+
+
+def test_differentiate():
+    expr = AstNode.astify("x ^ 3")
+    derivative = differentiate(expr, x)
+    assert expr.is_equal(AstNode.astify("x ^ 3"))
+    assert derivative.is_equal(AstNode.astify("3 * x ^ 2"))
+
+
+def test_differentiate_shares():
+    expr = AstNode.astify("exp(y * z) * x")
+    derivative = differentiate(expr, x)
+    assert expr.is_equal(AstNode.astify("exp(y * z) * x"))
+    assert derivative.is_equal(AstNode.astify("exp(y * z)"))
+    # Bound subtrees are substituted by value, so their children are shared.
+    assert derivative.children[0] is expr.children[0].children[0]
+
+
+def test_up_to():
+    derivatives = PartialDerivatives(AstNode.astify("x ^ 3")).up_to(x, 3)
+    assert derivatives[1].is_equal(AstNode.astify("3 * x ^ 2"))
+    assert derivatives[2].is_equal(AstNode.astify("6 * x ^ 1"))
+    assert derivatives[3].is_equal(AstNode.astify("6 * x ^ 0"))
+
+
+def test_partials_memoised(partials: PartialDerivatives):
+    assert partials.partial(x, y) is partials.partial(y, x)
+    assert partials.partial(x, y, x) is partials.table[((x, 2), (y, 1))]
+    assert partials.partial(x) is partials.table[((x, 1),)]
+
+
+def test_all_partials(partials: PartialDerivatives):
+    table = partials.all_partials([x, y], 2)
+    assert set(table) == {
+        (),
+        ((x, 1),),
+        ((y, 1),),
+        ((x, 2),),
+        ((x, 1), (y, 1)),
+        ((y, 2),),
+    }
+
+
+def test_hessian(partials: PartialDerivatives):
+    hessian = partials.hessian([x, y])
+    assert hessian[0][1] is hessian[1][0]
+    assert hessian[0][0].is_equal(partials.partial(x, x))
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_jacobian(parallel: bool):
+    z = Variable("z")
+    exprs = [
+        AstNode.astify("x * y"),
+        AstNode.astify("a * sin(z)"),
+        AstNode.astify("2 * y"),
+    ]
+    sparse = jacobian(exprs, [x, y, z], parallel=parallel, max_workers=2)
+    assert sparse.shape == (3, 3)
+    assert list(zip(sparse.rows, sparse.columns)) == [(0, 0), (0, 1), (1, 2), (2, 1)]
+    assert sparse.entries[0].is_equal(AstNode.astify("y"))
+    assert exprs[0].is_equal(AstNode.astify("x * y"))
+    dense = sparse.dense()
+    assert dense[1][0].value == 0.0
+    assert dense[1][2] is sparse.entries[2]
+
+    evaluator = sparse.compile()
+    values = evaluator(2.0, 3.0, 0.5, 7.0)
+    assert values == pytest.approx([3.0, 2.0, 7.0 * math.cos(0.5), 2.0])
+
+
+def test_jacobian_empty():
+    sparse = jacobian([AstNode.astify("a * 2")], [x])
+    assert len(sparse) == 0
+    assert sparse.compile()(1.0) == ()
+
+
+def is_expanded(expr: AstNode) -> bool:
+    return not any(node.value == operators["D"] for node in expr)
+
+
+def test_differentiate_subtraction_division():
+    expr = AstNode.astify("x - sin(x)")
+    derivative = differentiate(expr, x)
+    assert expr.is_equal(AstNode.astify("x - sin(x)"))
+    assert is_expanded(derivative)
+    assert math.isclose(evaluate(derivative, {x: 0.5}), 1 - math.cos(0.5))
+    hessian = PartialDerivatives(AstNode.astify("x / y")).hessian([x, y])
+    assert all(is_expanded(entry) for row in hessian for entry in row)
+    assert math.isclose(evaluate(hessian[1][1], {x: 3.0, y: 2.0}), 6.0 / 8.0)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_jacobian_subtraction_division(parallel: bool):
+    exprs = [AstNode.astify("x - sin(x)"), AstNode.astify("x / y")]
+    jac = jacobian(exprs, [x, y], parallel=parallel, max_workers=2)
+    assert all(is_expanded(entry) for entry in jac.entries)
+    f = jac.compile()
+    values = {x: 0.5, y: 2.0}
+    assert all(
+        math.isclose(value, evaluate(entry, values))
+        for value, entry in zip(f(0.5, 2.0), jac.entries)
+    )
+    assert math.isclose(evaluate(jac.dense()[1][1], values), -0.125)
@@ -0,0 +1,102 @@
+import math
+
+import pytest
+
+from astree import AstNode
+from egraph import EGraph, evaluation_cost, node_count, simplify
+from match import algebraic_rules, differentiation_rules
+from numeric import evaluate
+from symbols import Variable
+
+
+@pytest.mark.parametrize(
+    "string, expected",
+    [
+        ("x * 1 + 0", "x"),
+        ("(x + y) - (x + y)", "0"),
+        ("ln(exp(x))", "x"),
+    ],
+)
+def test_simplify(string: str, expected: str):
+    assert simplify(AstNode.astify(string)).is_equal(AstNode.astify(expected))
+
+
+def test_simplify_folds_constants():
+    simplified = simplify(AstNode.astify("2 * 3 + x"))
+    assert simplified.is_equal(AstNode.astify("x + 6")) or simplified.is_equal(
+        AstNode.astify("6 + x")
+    )
+
+
+def test_simplify_smaller():
+    expr = AstNode.astify("a * b + a * c")
+    simplified = simplify(expr)
+    count = lambda tree: sum(1 for _ in tree)
+    assert count(simplified) < count(expr)
+    values = {Variable("a"): 2.0, Variable("b"): 3.0, Variable("c"): 5.0}
+    assert evaluate(simplified, values) == evaluate(expr, values)
+
+
+def test_congruence():
+    egraph = EGraph()
+    a = egraph.add(AstNode.astify("sin(x)"))
+    b = egraph.add(AstNode.astify("sin(y)"))
+    assert egraph.find(a) != egraph.find(b)
+    egraph.union(egraph.add(AstNode.astify("x")), egraph.add(AstNode.astify("y")))
+    egraph.rebuild()
+    assert egraph.find(a) == egraph.find(b)
+
+
+def test_constant_folding():
+    egraph = EGraph()
+    class_id = egraph.add(AstNode.astify("2 ^ 3 + 1"))
+    assert egraph.constants[class_id] == 9.0
+    assert egraph.extract(class_id).is_equal(AstNode.astify("9"))
+
+
+def test_flattened_input():
+    egraph = EGraph()
+    summands = [AstNode.astify(name) for name in "abc"]
+    class_id = egraph.add(AstNode(AstNode.astify("a + b").value, summands))
+    assert egraph.extract(class_id).is_equal(AstNode.astify("a + b + c"))
+
+
+def test_node_limit():
+    egraph = EGraph()
+    egraph.add(AstNode.astify("a + b + c + d + e + f"))
+    assert not egraph.saturate(algebraic_rules, node_limit=50)
+    assert egraph.size() < 100
+
+
+def test_differentiation():
+    x = Variable("x")
+    expr = AstNode.astify("x D (x * sin(x))")
+    rules = differentiation_rules + algebraic_rules
+    derivative = simplify(expr, rules, evaluation_cost, iter_limit=5)
+    assert not any(node.value == expr.value for node in derivative)
+    assert math.isclose(
+        evaluate(derivative, {x: 0.5}), math.sin(0.5) + 0.5 * math.cos(0.5)
+    )
+    assert node_count(expr.value, [1, 1]) == 3
+
+
+def test_extract_deterministic():
+    import os
+    import subprocess
+    import sys
+
+    code = (
+        "from astree import AstNode; from egraph import simplify; "
+        "print(simplify(AstNode.astify('x * 2 + y * x - 3 * x')).infix())"
+    )
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONHASHSEED": seed},
+        ).stdout
+        for seed in ["1", "2"]
+    }
+    assert len(outputs) == 1
@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+import fingerprint
+from astree import AstNode
+from derivatives import differentiate
+from fingerprint import Fingerprinter
+from symbols import Variable
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "scalar"])
+def fingerprinter(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch):
+    if not request.param:
+        monkeypatch.setattr(fingerprint, "np", None)
+    elif fingerprint.np is None:
+        pytest.skip("NumPy is not installed")
+    return Fingerprinter()
+
+
+def test_equivalent(fingerprinter: Fingerprinter):
+    a = AstNode.astify("x * (y + 1)")
+    b = AstNode.astify("y * x + x")
+    assert not a.is_equal(b)
+    assert fingerprinter.equivalent(a, b)
+    assert fingerprinter.key(a) == fingerprinter.key(b)
+    c = AstNode.astify("x * (y + 1.001)")
+    assert not fingerprinter.equivalent(a, c)
+    assert fingerprinter.key(a) != fingerprinter.key(c)
+
+
+def test_derivative(fingerprinter: Fingerprinter):
+    derivative = differentiate(AstNode.astify("sin(x) * exp(x)"), Variable("x"))
+    expected = AstNode.astify("exp(x) * (sin(x) + cos(x))")
+    assert fingerprinter.equivalent(derivative, expected)
+
+
+def test_domain_errors(fingerprinter: Fingerprinter):
+    log = AstNode.astify("ln(x + 1)")
+    values = fingerprinter.fingerprint(log)
+    points = fingerprinter.points(Variable("x"))
+    assert all(math.isnan(v) == (p <= -1) for v, p in zip(values, points))
+    assert fingerprinter.equivalent(log, AstNode.astify("ln(x + 1) * 1"))
+    assert not fingerprinter.equivalent(log, AstNode.astify("ln(sq(x + 1)) / 2"))
+    assert fingerprinter.fingerprint(AstNode.astify("(x - 3) ^ 0.5")) == pytest.approx(
+        [math.nan] * fingerprinter.num_points, nan_ok=True
+    )
+
+
+def test_constant(fingerprinter: Fingerprinter):
+    assert fingerprinter.key(AstNode.astify("2 * 3")) == (6.0,) * 16
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [("x D (x ^ y)", "y D sin(y)"), ("ln(-1 - x)", "ln(-2 - sq(y))")],
+)
+def test_undefined(fingerprinter: Fingerprinter, a: str, b: str):
+    a_expr, b_expr = AstNode.astify(a), AstNode.astify(b)
+    assert not fingerprinter.equivalent(a_expr, b_expr)
+    assert fingerprinter.equivalent(a_expr, AstNode.astify(a))
+    assert fingerprinter.key(b_expr) is None
+
+
+def test_negative_points(fingerprinter: Fingerprinter):
+    assert not fingerprinter.equivalent(
+        AstNode.astify("ln(x)"), AstNode.astify("ln(sq(x)) / 2")
+    )
+
+
+def test_reproducible():
+    expr = AstNode.astify("exp(a) * b")
+    assert Fingerprinter().key(expr) == Fingerprinter().key(expr)
+    assert Fingerprinter(seed=1).key(expr) != Fingerprinter().key(expr)
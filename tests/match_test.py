@@ -1,11 +1,24 @@
+import math
+import os
+import sys
+
 from astree import AstNode
-from symbols import Variable
+from numeric import evaluate, evaluate_dual
+from pipeline import differentiation_pipeline
+from symbols import (
+    UnaryOperator,
+    Variable,
+    operator_table,
+    operators,
+    register_operator,
+)
 from match import (
     PatternVariable,
     PatternMatching,
     normalisation_patterns,
     differentiation_rules,
 )
+from rules import Flattening
 import pytest
 from typing import Sequence
 
@@ -70,3 +83,180 @@ def test_differentiation():
     expr = AstNode.astify("x D (x * x)")
     assert differentiation_rules[3].apply_all(expr)
     assert differentiation_rules[1].apply_all(expr)
+
+
+def flatten(expr: AstNode) -> AstNode:
+    Flattening().apply_all(expr)
+    return expr
+
+
+def test_match_ac_flattened():
+    pattern = AstNode.astify("f * exp(g)")
+    PatternVariable.patternify(pattern)
+    expr = flatten(AstNode.astify("a * exp(b) * c"))
+    bindings: dict[PatternVariable, AstNode] = {}
+    assert PatternMatching.match(expr, pattern, bindings)
+    assert bindings[PatternVariable("f")].is_equal(flatten(AstNode.astify("a * c")))
+    assert bindings[PatternVariable("g")].is_equal(AstNode.astify("b"))
+
+
+def test_match_ac_binary_positional():
+    pattern = AstNode.astify("f + g")
+    PatternVariable.patternify(pattern)
+    bindings: dict[PatternVariable, AstNode] = {}
+    assert PatternMatching.match(AstNode.astify("a + b"), pattern, bindings)
+    assert bindings[PatternVariable("f")].value == Variable("a")
+    assert bindings[PatternVariable("g")].value == Variable("b")
+
+
+def test_match_ac_backtracking():
+    pattern = flatten(AstNode.astify("f * f * s"))
+    PatternVariable.patternify(pattern)
+    expr = flatten(AstNode.astify("x * 2 * y * x"))
+    bindings: dict[PatternVariable, AstNode] = {}
+    assert not PatternMatching.match(expr, pattern, bindings)
+    assert bindings == {}
+    expr = flatten(AstNode.astify("y * 2 * y"))
+    assert PatternMatching.match(expr, pattern, bindings)
+    assert bindings[PatternVariable("f")].value == Variable("y")
+    assert bindings[PatternVariable("s")].value == 2
+
+
+def test_match_ac_too_few_children():
+    pattern = AstNode.astify("(x D f) * g * h")
+    PatternVariable.patternify(pattern)
+    assert not PatternMatching.match(AstNode.astify("a * b"), pattern, {})
+
+
+def test_product_rule_flattened():
+    expr = flatten(AstNode.astify("x D (x * sin(x) * exp(x))"))
+    for rule in differentiation_rules:
+        rule.apply_all(expr)
+    assert expr.value == AstNode.astify("a + b").value
+
+
+def test_differentiation_constant_subtree():
+    expr = AstNode.astify("x D (y * sin(z) * exp(y))")
+    assert differentiation_rules[3].apply_root(expr)
+    assert expr.is_leaf()
+    assert expr.value == 0
+    expr = AstNode.astify("x D y")
+    assert differentiation_rules[1].apply_all(expr)
+    assert expr.value == 0
+
+
+@pytest.fixture
+def tan():
+    tan = register_operator(
+        UnaryOperator(
+            "tan",
+            1,
+            4,
+            "right",
+            False,
+            math.tan,
+            lambda x: 1 / math.cos(x) ** 2,
+            "sq(cos(f)) ^ -1",
+        )
+    )
+    yield tan
+    operators.pop("tan")
+    operator_table.pop()
+    differentiation_rules.pop()
+
+
+def test_register_operator(tan: UnaryOperator):
+    assert differentiation_rules[-1].name == "tan chain rule"
+    expr = AstNode.astify("x D tan(x * x)")
+    assert expr.children[1].value is tan
+    differentiation_pipeline.apply_all(expr)
+    x = Variable("x")
+    expected = evaluate_dual(AstNode.astify("tan(x * x)"), {x: 0.5}, x)
+    assert math.isclose(evaluate(expr, {x: 0.5}), expected.derivative)
+
+
+def test_sq_and_ln_chain_rules():
+    x = Variable("x")
+    expr = AstNode.astify("x D ln(sq(x) + 1)")
+    differentiation_pipeline.apply_all(expr)
+    assert math.isclose(evaluate(expr, {x: 2.0}), 4 / 5)
+
+
+def test_rule_cache(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    import match
+
+    monkeypatch.setattr(match, "rule_cache_dir", str(tmp_path))
+    built = match.load_rules()
+    (cache,) = tmp_path.iterdir()
+    loaded = match.load_rules()
+    assert loaded.keys() == built.keys()
+    for name, rules in built.items():
+        assert [rule.name for rule in loaded[name]] == [rule.name for rule in rules]
+        for rule, loaded_rule in zip(rules, loaded[name]):
+            assert loaded_rule.pattern.is_equal(rule.pattern)
+            assert loaded_rule.replacement.is_equal(rule.replacement)
+    assert loaded["normalisation_patterns"][0].pattern.value is operators["-"]
+
+    monkeypatch.setitem(
+        match.rule_sets,
+        "normalisation_patterns",
+        (PatternMatching, match.normalisation_specs[:1]),
+    )
+    assert len(match.load_rules()["normalisation_patterns"]) == 1
+    assert len(list(tmp_path.iterdir())) == 2
+    assert cache.exists()
+
+
+def test_rule_cache_keyed_by_source(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    import match
+
+    monkeypatch.setattr(match, "rule_cache_dir", str(tmp_path))
+    specs = match.all_specs()
+    key = match.rule_cache_key(specs)
+    source = tmp_path / "rules_source.py"
+    source.write_text("# a different version\n")
+    module = type(sys)("rules_source")
+    module.__file__ = str(source)
+    monkeypatch.setitem(sys.modules, "rules_source", module)
+    monkeypatch.setattr(
+        match, "rule_cache_modules", [*match.rule_cache_modules, "rules_source"]
+    )
+    assert match.rule_cache_key(specs) != key
+
+
+def test_rule_cache_incompatible(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    import match
+
+    monkeypatch.setattr(match, "rule_cache_dir", str(tmp_path))
+    key = match.rule_cache_key(match.all_specs())
+    path = tmp_path / f"rules.{key[:16]}.pickle"
+    # A pickle referring to a module which no longer exists.
+    path.write_bytes(b"cno_such_module\nRule\n.")
+    rules = match.load_rules()
+    assert len(rules["normalisation_patterns"]) == 2
+
+
+def test_rules_built_lazily():
+    import subprocess
+    import sys
+
+    code = "import pipeline, match; print('differentiation_rules' in vars(match))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_rule_cache_off_by_default():
+    import subprocess
+
+    code = "import match; print(repr(match.rule_cache_dir))"
+    env = {k: v for k, v in os.environ.items() if k != "SYMDIFF_RULE_CACHE"}
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    assert result.stdout.strip() == "None"
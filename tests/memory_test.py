@@ -0,0 +1,51 @@
+from astree import AstNode
+from memory import AllocationTracker, counting, tree_stats
+from pipeline import Innermost, differentiation_pipeline, normalisation_group
+from symbols import Variable
+
+
+def test_tree_stats():
+    stats = tree_stats(AstNode.astify("x * x + exp(2)"))
+    assert (stats.nodes, stats.objects, stats.subtrees) == (6, 6, 5)
+    assert stats.sharing == 1
+    assert stats.size > 0
+
+
+def test_tree_stats_shared():
+    square = AstNode.astify("y * y")
+    expr = AstNode.astify("x + sin(x)").compose({Variable("x"): square}, share=True)
+    stats = tree_stats(expr)
+    assert (stats.nodes, stats.objects, stats.subtrees) == (8, 5, 4)
+    assert stats.sharing == 8 / 5
+    assert stats.size < tree_stats(expr.copy()).size
+
+
+def test_counting():
+    with counting():
+        AstNode.astify("x + 1").copy()
+    assert "__init__" not in AstNode.__dict__
+    assert "__del__" not in AstNode.__dict__
+
+
+def test_tracker():
+    expr = AstNode.astify("x D (sin(x) * x ^ 3 + exp(x * y))")
+    expected = expr.copy()
+    differentiation_pipeline.apply_all(expected)
+    tracker = AllocationTracker()
+    tracker.run(differentiation_pipeline, expr)
+    assert expr.is_equal(expected)
+    total = tracker.steps["pipeline TransformationPipeline"]
+    assert total.calls == 1
+    assert total.created > 0
+    steps = [tracker.steps[f"pipeline.{i} Innermost"] for i in range(2)]
+    assert total.created == sum(step.created for step in steps)
+    assert tracker.rules["product rule"].created > 0
+    assert tracker.rules["product rule"].calls == tracker.rules["sum rule"].calls
+    assert "product rule" in tracker.report()
+
+
+def test_tracker_tracemalloc():
+    tracker = AllocationTracker(use_tracemalloc=True)
+    tracker.run(Innermost(normalisation_group), AstNode.astify("x - y / 2"))
+    assert tracker.steps["pipeline Innermost"].allocated > 0
+    assert "bytes" in tracker.report()
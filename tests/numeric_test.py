@@ -0,0 +1,97 @@
+import math
+
+import pytest
+
+from astree import AstNode
+from derivatives import differentiate
+from numeric import Dual, evaluate, evaluate_dual
+from symbols import Variable
+
+x, y = Variable("x"), Variable("y")
+
+exprs = [
+    "3 * x ^ 2 + y",
+    "sin(x * y) / exp(x)",
+    "ln(sq(x) + 1) - cos(2 * x)",
+    "x ^ y",
+    "2 ^ x",
+]
+
+
+def test_evaluate():
+    expr = AstNode.astify("3 * x ^ 2 - y / 2")
+    assert evaluate(expr, {x: 2.0, y: 4.0}) == 10.0
+
+
+def test_evaluate_flattened():
+    expr = AstNode.astify("1 + x + y + 3")
+    expr.children = [expr.children[0].children[0].children[0]] + [
+        AstNode.leafify(x),
+        AstNode.leafify(y),
+        AstNode.leafify(3.0),
+    ]
+    assert evaluate(expr, {x: 2.0, y: 4.0}) == 10.0
+
+
+def test_dual_arithmetic():
+    a = Dual(2.0, 1.0)
+    assert (a * a).derivative == 4.0
+    assert (1 / a).derivative == -0.25
+    assert (3 - a).value == 1.0
+    assert (a**3).derivative == 12.0
+
+
+@pytest.mark.parametrize("string", exprs)
+def test_evaluate_dual(string: str):
+    expr = AstNode.astify(string)
+    values = {x: 0.7, y: 1.3}
+    dual = evaluate_dual(expr, values, x)
+    assert math.isclose(dual.value, evaluate(expr, values))
+    h = 1e-6
+    numeric = (
+        evaluate(expr, {x: 0.7 + h, y: 1.3}) - evaluate(expr, {x: 0.7 - h, y: 1.3})
+    ) / (2 * h)
+    assert math.isclose(dual.derivative, numeric, rel_tol=1e-6)
+
+
+def test_evaluate_dual_matches_symbolic():
+    expr = AstNode.astify("x ^ 3 * sin(x)")
+    values = {x: 1.5}
+    symbolic = evaluate(differentiate(expr, x), values)
+    assert math.isclose(evaluate_dual(expr, values, x).derivative, symbolic)
+
+
+def test_evaluate_dual_constant():
+    dual = evaluate_dual(AstNode.astify("2 * y"), {y: 3.0}, x)
+    assert dual.value == 6.0
+    assert dual.derivative == 0.0
+
+
+def test_evaluate_dual_vectorised():
+    np = pytest.importorskip("numpy")
+    expr = AstNode.astify("sin(x) * exp(y) + sq(x)")
+    xs = np.linspace(0.0, 1.0, 5)
+    dual = evaluate_dual(expr, {x: xs, y: np.ones(5)}, x)
+    assert np.allclose(dual.value, np.sin(xs) * math.e + xs**2)
+    assert np.allclose(dual.derivative, np.cos(xs) * math.e + 2 * xs)
+
+
+def test_dual_array_on_left():
+    np = pytest.importorskip("numpy")
+    xs = np.linspace(0.5, 1.5, 4)
+    ys = np.arange(1.0, 5.0)
+    dual = Dual(xs, np.ones(4))
+    product = ys * dual
+    assert isinstance(product, Dual)
+    assert np.allclose(product.value, ys * xs)
+    assert np.allclose(product.derivative, ys)
+    power = 2**dual
+    assert isinstance(power, Dual)
+    assert np.allclose(power.derivative, 2**xs * math.log(2))
+    dual = evaluate_dual(AstNode.astify("y * x + 2 ^ x"), {x: xs, y: ys}, x)
+    assert np.allclose(dual.derivative, ys + 2**xs * math.log(2))
+
+
+def test_dual_power_zero():
+    dual = evaluate_dual(AstNode.astify("x ^ 0 + x ^ 2"), {x: 0.0}, x)
+    assert (dual.value, dual.derivative) == (1.0, 0.0)
@@ -1,11 +1,28 @@
+import math
+import sys
+import threading
+
 import pytest
 
 from astree import AstNode
+from numeric import evaluate
 from pipeline import (
+    BottomUpOnce,
+    Choice,
+    Innermost,
+    Outermost,
+    Repeat,
+    Sequential,
+    TopDownOnce,
+    TransformationGroup,
+    apply_batch,
+    normalise_parallel,
     differentiation_group,
     differentiation_pipeline,
     normalisation_group,
 )
+from rules import Flattening, Simplification, Transformation
+from symbols import Variable, operators
 
 """
         normalisation_rules[0],
@@ -24,3 +41,202 @@ def test_normalisation_group(test_expr: AstNode):
     expected_expr = AstNode.astify("-4 * (6 + x)")
     assert test_expr.is_equal(expected_expr)
 
+
+def test_differentiation_pipeline_flattened():
+    expr = AstNode.astify("x D (x * x * sin(x) + x ^ 3 + 2 * x)")
+    flattened = expr.copy()
+    normalisation_group.apply_all(flattened.children[1])
+    differentiation_pipeline.apply_all(expr)
+    differentiation_pipeline.apply_all(flattened)
+    values = {Variable("x"): 0.3}
+    assert math.isclose(evaluate(expr, values), evaluate(flattened, values))
+    assert not any(node.value == operators["D"] for node in flattened)
+
+
+stress_exprs = [
+    "x D (x * x * sin(x) + x ^ 3 + 2 * x)",
+    "x D exp(sin(x) * cos(x))",
+    "x D ln(sq(x) + 1) / x",
+    "y D (x * y - y ^ 2 * exp(y))",
+]
+
+
+def test_threads_share_pipelines():
+    expected = []
+    for string in stress_exprs:
+        expr = AstNode.astify(string)
+        differentiation_pipeline.apply_all(expr)
+        expected.append(expr.infix())
+
+    num_threads, repeats = 16, 20
+    barrier = threading.Barrier(num_threads)
+    results: list[list[str]] = [[] for _ in range(num_threads)]
+
+    def work(i: int):
+        barrier.wait()
+        for _ in range(repeats):
+            for string in stress_exprs:
+                expr = AstNode.astify(string)
+                differentiation_pipeline.apply_all(expr)
+                results[i].append(expr.infix())
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [
+            threading.Thread(target=work, args=(i,))
+            for i in range(num_threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert all(result == expected * repeats for result in results)
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_apply_batch(processes: bool):
+    exprs = [AstNode.astify(string) for string in stress_exprs]
+    expected = [expr.copy() for expr in exprs]
+    for expr in expected:
+        differentiation_pipeline.apply_all(expr)
+    results = apply_batch(differentiation_pipeline, exprs, 2, processes)
+    assert all(map(AstNode.is_equal, results, expected))
+    assert (results[0] is exprs[0]) != processes
+
+
+def test_once_strategies():
+    expr = AstNode.astify("((a + b) + c) + d")
+    flat = AstNode(operators["+"], [AstNode.astify(v) for v in "abcd"])
+    bottom_up = expr.copy()
+    assert BottomUpOnce(Flattening()).apply_all(bottom_up)
+    assert bottom_up.is_equal(flat)
+    top_down = expr.copy()
+    assert TopDownOnce(Flattening()).apply_all(top_down)
+    assert top_down.num_children() == 3
+    assert Repeat(TopDownOnce(Flattening())).apply_all(top_down)
+    assert top_down.is_equal(flat)
+    assert not Repeat(TopDownOnce(Flattening())).apply_all(top_down)
+
+
+def test_repeat_limit():
+    expr = AstNode.astify("((a + b) + c) + d")
+    Repeat(TopDownOnce(Flattening()), limit=1).apply_all(expr)
+    assert expr.num_children() == 3
+
+
+@pytest.mark.parametrize("strategy", [Innermost, Outermost])
+def test_normal_form_strategies(strategy, test_expr: AstNode):
+    strategy(normalisation_group).apply_all(test_expr)
+    assert test_expr.is_equal(AstNode.astify("-4 * (6 + x)"))
+
+
+def test_normal_form_strategies_differentiate():
+    string = "x D (x * x * sin(x) + exp(x ^ 3) * 2 * x)"
+    expected = AstNode.astify(string)
+    differentiation_group.apply_all(expected)
+    normalisation_group.apply_all(expected)
+    for strategy in [Innermost, Outermost]:
+        expr = AstNode.astify(string)
+        Sequential(
+            strategy(differentiation_group), strategy(normalisation_group)
+        ).apply_all(expr)
+        assert expr.is_equal(expected)
+
+
+def test_choice():
+    expr = AstNode.astify("(a + b) + 0")
+    simplification = BottomUpOnce(TransformationGroup([Simplification()]))
+    flattening = BottomUpOnce(Flattening())
+    assert Choice(flattening, simplification).apply_all(expr)
+    assert expr.num_children() == 3
+    assert Choice(flattening, simplification).apply_all(expr)
+    assert expr.num_children() == 2
+    assert not Choice(flattening, simplification).apply_all(expr)
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_normalise_parallel(processes: bool):
+    summands = [
+        f"{i} * x * (y - {i % 3}) * sin(x + {i}) + x / {i + 1} + 2 * {i}"
+        for i in range(40)
+    ]
+    expr = AstNode.astify(" + ".join(summands))
+    Flattening().apply_all(expr)
+    expected = expr.copy()
+    Innermost(normalisation_group).apply_all(expected)
+    normalise_parallel(expr, max_workers=2, processes=processes)
+    assert expr.is_equal(expected)
+    assert expr.free_variables() == {Variable("x"), Variable("y")}
+
+
+class AddUnit(Transformation):
+    """Adds an unsimplified 1 * z to a sum without a z, so new nodes are
+    created right after Simplification frees the zero summands.
+    """
+
+    def apply_root(self, expr: AstNode) -> bool:
+        if expr.value == operators["+"] and not any(
+            child.value in (operators["*"], Variable("z")) for child in expr.children
+        ):
+            expr.children.append(AstNode.astify("1 * z"))
+            return True
+        return False
+
+
+def test_normalise_parallel_ids_not_reused():
+    group = TransformationGroup([Simplification(), AddUnit()])
+    summands = " + ".join(f"0 * a{i}" for i in range(30))
+    for _ in range(5):
+        expr = AstNode.astify(f"{summands} + y + w")
+        Flattening().apply_all(expr)
+        normalise_parallel(expr, group, max_workers=1, processes=False)
+        assert expr.infix() == "y + w + z"
+
+
+persistent_steps = {
+    "group": normalisation_group,
+    "bottom up": Repeat(BottomUpOnce(normalisation_group)),
+    "top down": Repeat(TopDownOnce(normalisation_group)),
+    "innermost": Innermost(normalisation_group),
+    "outermost": Outermost(normalisation_group),
+    "choice": Repeat(
+        Choice(BottomUpOnce(Flattening()), Innermost(normalisation_group))
+    ),
+}
+
+
+@pytest.mark.parametrize("step", persistent_steps.values(), ids=persistent_steps)
+def test_transform_persistent(step):
+    expr = AstNode.astify("exp(a * b) * ((3 + ((x - 2) + 5)) * (1 * -4))")
+    untouched = expr.children[0]
+    original = expr.copy()
+    expected = expr.copy()
+    step.apply_all(expected)
+    result = step.transform(expr)
+    assert expr.is_equal(original)
+    assert result.is_equal(expected)
+    assert any(node is untouched for node in result)
+    assert step.transform(result) is result
+
+
+@pytest.mark.parametrize("string", stress_exprs)
+def test_transform_differentiation_pipeline(string: str):
+    expr = AstNode.astify(string)
+    original = expr.copy()
+    expected = expr.copy()
+    differentiation_pipeline.apply_all(expected)
+    assert differentiation_pipeline.transform(expr).is_equal(expected)
+    assert expr.is_equal(original)
+
+
+def test_import_skips_executors():
+    import subprocess
+
+    code = "import sys, pipeline; print('concurrent.futures' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
@@ -8,7 +8,8 @@ from rules import (
     Simplification,
     UnFlattening,
 )
-from symbols import Variable
+from pipeline import normalisation_group
+from symbols import Variable, operators
 
 
 @pytest.fixture
@@ -54,6 +55,17 @@ def test_unflattening(flattener: Flattening, unflattener: UnFlattening):
     assert unflattener.apply_all(expr)
 
 
+def test_unflattening_transform(flattener: Flattening, unflattener: UnFlattening):
+    expr = AstNode.astify("y * ((2 + x +  t + z) + -4)")
+    flattener.apply_all(expr)
+    expected = expr.copy()
+    unflattener.apply_all(expected)
+    result = unflattener.transform(expr)
+    assert result.is_equal(expected)
+    assert expr.children[1].num_children() == 5
+    assert result.children[0] is expr.children[0]
+
+
 def test_canonicalordering(flattener: Flattening, canonical_orderer: CanonicalOrdering):
     expr = AstNode.astify("x + 3 + -5.7 + exp(11) + y")
     assert flattener.apply_all(expr)
@@ -67,6 +79,29 @@ def test_canonicalordering(flattener: Flattening, canonical_orderer: CanonicalOr
     ]
 
 
+def test_canonicalordering_total(canonical_orderer: CanonicalOrdering):
+    a = AstNode.astify("sin(x) * cos(x) * exp(y * x) * exp(x * y)")
+    b = AstNode.astify("exp(x * y) * cos(x) * exp(y * x) * sin(x)")
+    Flattening().apply_all(a)
+    Flattening().apply_all(b)
+    canonical_orderer.apply_all(a)
+    canonical_orderer.apply_all(b)
+    assert a.is_equal(b)
+    assert not canonical_orderer.apply_all(a)
+
+
+def test_canonicalordering_nan(canonical_orderer: CanonicalOrdering):
+    nan = AstNode.leafify(float("nan"))
+    expr = AstNode(operators["*"], [AstNode.astify("sin(x)"), nan, AstNode.astify("2")])
+    assert canonical_orderer.apply_root(expr)
+    assert expr.children[1] is nan
+    assert not canonical_orderer.apply_root(expr)
+    nans = "sin(x) * (1e308 * 10 - 1e308 * 10)"
+    expr = AstNode.astify(f"{nans} + {nans}")
+    normalisation_group.apply_all(expr)
+    assert expr.num_children() == 2
+
+
 def test_evaluation(evaluator: Evaluation):
     # expr = AstNode.astify("1 + 2")
     # assert evaluator.apply_all(expr)
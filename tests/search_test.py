@@ -0,0 +1,59 @@
+import pytest
+
+from astree import AstNode
+from match import PatternVariable
+from search import SubtermIndex, head_paths
+from symbols import operators
+
+
+def pattern(string: str) -> AstNode:
+    expr = AstNode.astify(string)
+    PatternVariable.patternify(expr)
+    return expr
+
+
+@pytest.fixture
+def index():
+    index = SubtermIndex()
+    for string in [
+        "exp(x) * y + sin(x)",
+        "sin(x) * exp(x * y)",
+        "cos(x) + 2",
+        "a * exp(b) * c",
+    ]:
+        index.add(AstNode.astify(string))
+    return index
+
+
+def test_head_paths():
+    times, exp = operators["*"], operators["exp"]
+    assert head_paths(pattern("exp(f) * g"), 3) == {(times,), (times, exp)}
+    assert head_paths(AstNode.astify("exp(x)"), 1) == {(exp,)}
+
+
+def test_find(index: SubtermIndex):
+    occurrences = index.find(AstNode.astify("sin(x)"))
+    assert [number for number, _ in occurrences] == [0, 1]
+    assert all(node.is_equal(AstNode.astify("sin(x)")) for _, node in occurrences)
+    assert index.find(AstNode.astify("sin(y)")) == []
+    assert len(index.find(AstNode.astify("x"))) == 5
+
+
+def test_find_pattern(index: SubtermIndex):
+    occurrences = index.find_pattern(pattern("exp(f) * g"))
+    assert [number for number, _ in occurrences] == [0, 1, 3]
+    assert index.candidates(pattern("cos(f)")) == {
+        index.subterm_id(AstNode.astify("cos(x)"))
+    }
+    assert len(index.find_pattern(pattern("f + s"))) == 1
+
+
+def test_incremental_and_save(index: SubtermIndex, tmp_path):
+    assert index.add(AstNode.astify("exp(z) * 3")) == 4
+    assert [n for n, _ in index.find_pattern(pattern("exp(f) * g"))] == [0, 1, 3, 4]
+    path = str(tmp_path / "index.pickle")
+    index.save(path)
+    loaded = SubtermIndex.load(path)
+    assert len(loaded) == 5
+    assert [n for n, _ in loaded.find_pattern(pattern("exp(f) * g"))] == [0, 1, 3, 4]
+    assert len(loaded.find(AstNode.astify("sin(x)"))) == 2
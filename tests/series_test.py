@@ -0,0 +1,100 @@
+import math
+
+import pytest
+
+import match
+from astree import AstNode
+from derivatives import PartialDerivatives
+from numeric import evaluate
+from series import taylor, taylor_symbolic
+from symbols import (
+    UnaryOperator,
+    Variable,
+    operator_table,
+    operators,
+    register_operator,
+)
+
+x, y = Variable("x"), Variable("y")
+
+
+def test_known_series():
+    coefficients = taylor(AstNode.astify("exp(x)"), x, 0.0, 6)
+    assert coefficients == pytest.approx([1 / math.factorial(k) for k in range(7)])
+    sin = taylor(AstNode.astify("sin(x)"), x, 0.0, 5)
+    assert sin == pytest.approx([0, 1, 0, -1 / 6, 0, 1 / 120])
+    log = taylor(AstNode.astify("ln(1 + x)"), x, 0.0, 5)
+    assert log == pytest.approx([0, 1, -1 / 2, 1 / 3, -1 / 4, 1 / 5])
+    geometric = taylor(AstNode.astify("1 / (1 - x)"), x, 0.0, 5)
+    assert geometric == pytest.approx([1.0] * 6)
+    assert taylor(AstNode.astify("sq(x) + 2"), x, 3.0, 0) == [11.0]
+
+
+@pytest.mark.parametrize(
+    "string",
+    [
+        "exp(sin(x) * y)",
+        "ln(sq(x) + 1) * x ^ -1",
+        "x ^ 3.5 + cos(x) ^ 2",
+        "sin(x) * exp(x) + y",
+    ],
+)
+def test_matches_derivatives(string: str):
+    expr = AstNode.astify(string)
+    values = {x: 0.9, y: 0.7}
+    coefficients = taylor(expr, x, 0.9, 4, {y: 0.7})
+    derivatives = PartialDerivatives(expr).up_to(x, 4)
+    for k, (coefficient, derivative) in enumerate(zip(coefficients, derivatives)):
+        expected = evaluate(derivative, values) / math.factorial(k)
+        assert math.isclose(coefficient, expected, rel_tol=1e-9, abs_tol=1e-12)
+
+
+@pytest.mark.parametrize("string", ["x ^ x", "2 ^ x * sin(x) - y / x"])
+def test_general_powers(string: str):
+    expr = AstNode.astify(string)
+    coefficients = taylor(expr, x, 0.9, 8, {y: 0.7})
+    h = 0.01
+    approximation = sum(c * h**k for k, c in enumerate(coefficients))
+    assert math.isclose(approximation, evaluate(expr, {x: 0.9 + h, y: 0.7}))
+
+
+def test_symbolic():
+    expr = AstNode.astify("sin(x) * y")
+    coefficients = taylor_symbolic(expr, x, 3, AstNode.astify("0"))
+    assert coefficients[0].value == coefficients[2].value == 0.0
+    assert coefficients[1].is_equal(AstNode.astify("y"))
+    assert coefficients[3].is_equal(AstNode.astify("-0.16666666666666666 * y"))
+
+    expr = AstNode.astify("exp(sin(x)) * x ^ 3")
+    symbolic = taylor_symbolic(expr, x, 5)
+    numeric = taylor(expr, x, 0.4, 5)
+    values = {x: 0.4}
+    assert [evaluate(c, values) for c in symbolic] == pytest.approx(numeric)
+
+
+def test_arrays():
+    np = pytest.importorskip("numpy")
+    points = np.array([0.1, 0.5, 2.0])
+    coefficients = taylor(AstNode.astify("exp(x) * sin(x)"), x, points, 3)
+    for i, point in enumerate(points):
+        expected = taylor(AstNode.astify("exp(x) * sin(x)"), x, float(point), 3)
+        assert [c[i] for c in coefficients] == pytest.approx(expected)
+
+
+@pytest.fixture
+def tan():
+    match.differentiation_rules
+    tan = register_operator(
+        UnaryOperator(
+            "tan", 1, 4, "right", False, math.tan, None, "sq(cos(f)) ^ -1"
+        )
+    )
+    yield tan
+    operators.pop("tan")
+    operator_table.pop()
+    match.differentiation_rules.pop()
+
+
+def test_registered_operator(tan: UnaryOperator):
+    coefficients = taylor(AstNode.astify("tan(x)"), x, 0.0, 7)
+    assert coefficients == pytest.approx([0, 1, 0, 1 / 3, 0, 2 / 15, 0, 17 / 315])
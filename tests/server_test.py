@@ -0,0 +1,71 @@
+import asyncio
+import json
+import math
+
+import pytest
+
+from server import Server, compute
+
+
+def test_compute():
+    assert compute(("parse", "(x + 1) * 2", None, ())) == "( x + 1.0 ) * 2.0"
+    assert compute(("evaluate", "x * y", None, (("x", 2.0), ("y", 3.0)))) == 6.0
+    derivative = compute(("differentiate", "sin(x)", "x", ()))
+    value = compute(("evaluate", str(derivative), None, (("x", 0.5),)))
+    assert math.isclose(value, math.cos(0.5))
+    with pytest.raises(ValueError):
+        compute(("integrate", "x", None, ()))
+
+
+def test_coalescing_and_cache():
+    async def run():
+        server = Server(2, processes=False)
+        request = {"op": "differentiate", "expr": "x ^ 3", "variable": "x"}
+        try:
+            responses = await asyncio.gather(
+                *(server.handle({**request, "id": i}) for i in range(10))
+            )
+            assert [response["id"] for response in responses] == list(range(10))
+            assert len({response["result"] for response in responses}) == 1
+            assert server.stats["coalesced"] == 9
+            assert server.stats["batches"] == 1
+            await server.handle(request)
+            assert server.stats["cache hits"] == 1
+            error = await server.handle({"op": "evaluate", "expr": "x"})
+            assert "error" in error
+            assert list(server.cache) == [("differentiate", "x ^ 3", "x", ())]
+        finally:
+            server.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_tcp(processes: bool):
+    async def run():
+        server = Server(2, processes)
+        listener = await server.start()
+        host, port = listener.sockets[0].getsockname()[:2]
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            requests = [
+                {"id": 0, "op": "normalise", "expr": "x - 2 + 5"},
+                {"id": 1, "op": "differentiate", "expr": "x * x", "variable": "x"},
+                {"id": 2, "op": "evaluate", "expr": "x * 2", "values": {"x": 4}},
+            ]
+            for request in requests:
+                writer.write(json.dumps(request).encode() + b"\n")
+            writer.write(b"not json\n")
+            await writer.drain()
+            responses = [json.loads(await reader.readline()) for _ in range(4)]
+            writer.close()
+        finally:
+            listener.close()
+            server.close()
+        results = {response["id"]: response for response in responses}
+        assert results[0]["result"] == "3.0 + x"
+        assert compute(("evaluate", results[1]["result"], None, (("x", 3.0),))) == 6
+        assert results[2]["result"] == 8.0
+        assert "error" in results[None]
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import math
+
+import pytest
+
+from astree import AstNode
+from derivatives import differentiate
+from numeric import evaluate
+from pipeline import normalisation_group
+from session import Session
+from symbols import Variable, operators
+
+x, y = Variable("x"), Variable("y")
+
+
+@pytest.fixture
+def session():
+    return Session()
+
+
+def test_intern(session: Session):
+    a = session.parse("exp(x * y) + sin(x)")
+    b = session.parse("sin(x) * exp(x * y)")
+    assert a.children[0] is b.children[1]
+    assert a.children[1] is b.children[0]
+    assert session.size() == 7
+    assert session.intern(a) is a
+    assert session.parse("exp(x * y) + sin(x)") is a
+
+
+def test_intern_leaves_input(session: Session):
+    expr = AstNode.astify("x * x")
+    canonical = session.intern(expr)
+    assert canonical is not expr
+    assert canonical.children[0] is canonical.children[1]
+    assert expr.children[0] is not expr.children[1]
+
+
+def test_normalise(session: Session):
+    string = "(3 + ((x - 2) + 5)) * (1 * -4)"
+    expected = AstNode.astify(string)
+    normalisation_group.apply_all(expected)
+    expr = session.parse(string)
+    normal_form = session.normalise(expr)
+    assert normal_form.is_equal(expected)
+    assert session.normalise(expr) is normal_form
+    assert session.normalise(normal_form) is normal_form
+    assert expr.is_equal(AstNode.astify(string))
+
+
+def test_differentiate(session: Session):
+    strings = [
+        "exp(sin(x) * y) * x ^ 3",
+        "exp(sin(x) * y) + cos(x * y)",
+        "x * cos(x * y) + exp(sin(x) * y)",
+    ]
+    values = {x: 0.7, y: -1.3}
+    for string in strings:
+        expr = AstNode.astify(string)
+        expected = evaluate(differentiate(expr, x), values)
+        assert math.isclose(evaluate(session.differentiate(expr, x), values), expected)
+    # The derivative of exp(sin(x) * y) was computed once and shared.
+    first = session.differentiate(session.parse(strings[0]), x)
+    assert session.differentiate(session.parse(strings[0]), x) is first
+    shared = session.intern(AstNode.astify("x D exp(sin(x) * y)"))
+    assert id(shared) in session.derivatives
+    assert expr.is_equal(AstNode.astify(strings[2]))
+
+
+def test_differentiate_subtraction_division(session: Session):
+    for string in ["x - sin(x)", "x / y"]:
+        expr = AstNode.astify(string)
+        derivative = session.differentiate(expr, x)
+        assert not any(node.value == operators["D"] for node in derivative)
+        values = {x: 0.5, y: 2.0}
+        expected = evaluate(differentiate(expr, x), values)
+        assert math.isclose(evaluate(derivative, values), expected)
@@ -1,4 +1,15 @@
-from symbols import Variable, operators
+import pytest
+
+from astree import AstNode
+from symbols import (
+    FLOAT,
+    OPERATOR,
+    VARIABLE,
+    Variable,
+    kind,
+    operator_table,
+    operators,
+)
 
 
 def test_variable():
@@ -18,3 +29,37 @@ def test_operators_dict():
             prev_operator = operators[key]
     assert operators["+"] >= operators["-"]
     assert operators["-"] >= operators["+"]
+
+
+def test_kind():
+    assert kind(1.0) == FLOAT
+    assert kind(Variable("x")) == VARIABLE
+    assert kind(operators["sin"]) == OPERATOR
+
+
+def test_kind_float_subclass():
+    class Float(float):
+        pass
+
+    assert kind(Float(2.0)) == FLOAT
+    assert kind(Float(3.0)) == FLOAT
+    with pytest.raises(TypeError):
+        kind("x")
+
+
+def test_kind_numpy_float():
+    np = pytest.importorskip("numpy")
+    two = AstNode.leafify(np.float64(2.0))
+    expr = AstNode(operators["+"], [two, AstNode.astify("x")])
+    assert kind(expr.children[0].value) == FLOAT
+    assert expr.copy().is_equal(AstNode.astify("2 + x"))
+
+
+def test_opcodes():
+    opcodes = [operator.opcode for operator in operators.values()]
+    assert len(set(opcodes)) == len(opcodes)
+    for operator in operators.values():
+        assert operator_table[operator.opcode] is operator  # pyright: ignore
+    assert operators["+"] != operators["-"]
+    assert operators["+"] == operators["+"]
+    assert operators["+"] != Variable("+")
@@ -1,4 +1,6 @@
-from symbols import Operator, Variable, operators
+from typing import cast
+
+from symbols import OPERATOR, Operator, Variable, kind, operators
 
 type Token = float | Operator | Variable
 type Operand = float | Variable
@@ -42,38 +44,41 @@ def shunting_yard(tokens: list[Token]) -> list[Token]:
     out_stack: list[Token] = []
     operator_stack: list[Operator] = []
 
+    left_paren, right_paren = operators["("], operators[")"]
+
     for token in tokens:
-        if isinstance(token, float | Variable):
+        if kind(token) != OPERATOR:
             out_stack.append(token)
 
-        elif isinstance(token, Operator):
+        else:
+            token = cast(Operator, token)
             if token.arity == 1:
                 operator_stack.append(token)
 
             elif token.arity == 2:
                 while (
                     len(operator_stack) > 0
-                    and not operator_stack[-1] == operators["("]
+                    and not operator_stack[-1] == left_paren
                     and operator_stack[-1] >= token
                 ):
                     out_stack.append(operator_stack.pop())
                 operator_stack.append(token)
 
-            elif token == operators["("]:
+            elif token == left_paren:
                 operator_stack.append(token)
 
-            elif token == operators[")"]:
+            elif token == right_paren:
                 assert len(operator_stack) > 0
-                while not operator_stack[-1] == operators["("]:
+                while not operator_stack[-1] == left_paren:
                     out_stack.append(operator_stack.pop())
-                assert operator_stack[-1] == operators["("]
+                assert operator_stack[-1] == left_paren
                 operator_stack.pop()
 
                 if len(operator_stack) > 0 and operator_stack[-1].arity == 1:
                     out_stack.append(operator_stack.pop())
 
     while len(operator_stack) > 0:
-        assert not operator_stack[-1] == operators["("]
+        assert not operator_stack[-1] == left_paren
         out_stack.append(operator_stack.pop())
 
     return out_stack